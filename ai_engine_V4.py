@@ -1,8 +1,7 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import os
-from PIL import Image
-import io
-import google.generativeai as genai
+import re
 
 # Configure page settings - MUST be the first Streamlit command
 st.set_page_config(
@@ -12,35 +11,41 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Try to import elevenlabs with new API structure
-try:
-    from elevenlabs import generate, Voice, set_api_key
-    ELEVENLABS_AVAILABLE = True
-except ImportError:
-    ELEVENLABS_AVAILABLE = False
-
-def init_elevenlabs():
-    """Initialize ElevenLabs with proper error handling"""
-    if not ELEVENLABS_AVAILABLE:
-        return None
-        
-    try:
-        api_key = os.getenv("ELEVENLABS_API_KEY")
-        if not api_key:
-            return None
-            
-        # Initialize with the API key
-        set_api_key(api_key)
-        return True
-    except Exception:
-        return None
-
 import base64
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
 from datetime import datetime
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
+from call_gateway import gateway_stats
+from single_flight import single_flight_stats
+from canonical_items import canonicalization_stats, prompt_item_names
+from telemetry import record_cache, stage_stats
+from ecoscan_pipeline import (
+    CHAT_CONTEXT_SHARE,
+    CHAT_TOKEN_BUDGET,
+    ELEVENLABS_AVAILABLE,
+    STREAM_REFRESH_SECONDS,
+    VOICE_PIPELINE,
+    build_chat_history,
+    check_gemini_health,
+    create_voice_summary,
+    detect_items,
+    generate_voice_guidance,
+    get_chatbot_response,
+    get_environmental_impact,
+    get_environmental_metrics,
+    get_metrics_parse_stats,
+    get_recycling_instructions,
+    get_stage_executor,
+    get_tts_cache_stats,
+    init_elevenlabs,
+    pipeline_voice_guidance,
+    submit_after,
+)
 
 # Initialize session state for chat history
 if 'chat_history' not in st.session_state:
@@ -52,821 +57,621 @@ if 'mode' not in st.session_state:
 if 'thinking' not in st.session_state:
     st.session_state.thinking = False
 
-# Add custom CSS
-st.markdown("""
-    <style>
-    /* Global Styles and Variables */
-    :root {
-        --primary-green: #2E7D32;
-        --secondary-green: #4CAF50;
-        --accent-blue: #1565C0;
-        --background-light: #F5F9F5;
-        --text-dark: #1A1A1A;
-        --text-color: #000000;
-        --shadow: 0 2px 4px rgba(0,0,0,0.1);
-        --border-radius: 12px;
-        --spacing-unit: 1rem;
-    }
-
-    /* Main Container */
-    .stApp {
-        background-color: var(--background-light);
-        color: var(--text-color);
-        font-family: 'Inter', sans-serif;
-        max-width: 1400px;
-        margin: 0 auto;
-        padding: calc(var(--spacing-unit) * 2);
-    }
-
-    /* All text elements */
-    p, span, div, label, h1, h2, h3, h4, h5, h6 {
-        color: var(--text-color);
-    }
-
-    /* File uploader text */
-    .uploadfile-text, 
-    .stFileUploader label,
-    .stFileUploader span,
-    .stFileUploader p {
-        color: var(--text-color) !important;
-    }
-
-    /* Mode selector text */
-    .stRadio label span {
-        color: var(--text-color) !important;
-    }
-
-    /* Results text */
-    .results-container,
-    .results-container p,
-    .results-container span,
-    .results-container div {
-        color: var(--text-color);
-    }
-
-    /* White background containers */
-    div[style*="background: white"],
-    div[style*="background: white"] p,
-    div[style*="background: white"] span,
-    div[style*="background: white"] div {
-        color: var(--text-color) !important;
-    }
-
-    /* Footer text */
-    .footer-section p,
-    .footer-section span,
-    .footer-section div:not(.github-link) {
-        color: var(--text-color) !important;
-    }
-
-    /* Streamlit elements */
-    .stMarkdown,
-    .stMarkdown p,
-    .stText,
-    .stText p {
-        color: var(--text-color) !important;
-    }
-
-    /* Exception for elements that should remain white text */
-    .header-container,
-    .header-container h1,
-    .header-container p,
-    .github-link,
-    .stButton > button,
-    .stTabs [data-baseweb="tab"][aria-selected="true"] {
-        color: white !important;
-    }
-
-    /* Header Styling */
-    .header-container {
-        background: linear-gradient(135deg, #2E7D32 0%, #388E3C 100%);
-        padding: calc(var(--spacing-unit) * 2);
-        border-radius: var(--border-radius);
-        margin-bottom: calc(var(--spacing-unit) * 2);
-        box-shadow: var(--shadow);
-        text-align: center;
-    }
-
-    .header-container h1,
-    .header-container p {
-        color: white !important;
-        text-shadow: 0 2px 4px rgba(0,0,0,0.2);
-    }
-
-    .header-container h1 {
-        font-size: 2.5rem;
-        margin-bottom: var(--spacing-unit);
-    }
-
-    /* Mode Selector */
-    .mode-selector {
-        background: white;
-        padding: calc(var(--spacing-unit) * 0.75);
-        border-radius: var(--border-radius);
-        box-shadow: var(--shadow);
-        margin: var(--spacing-unit) 0;
-        display: inline-flex;
-        gap: calc(var(--spacing-unit) * 0.5);
-    }
-
-    /* File Uploader */
-    .uploadfile {
-        background: white;
-        border: 2px dashed var(--primary-green);
-        border-radius: var(--border-radius);
-        padding: calc(var(--spacing-unit) * 2);
-        margin: calc(var(--spacing-unit) * 2) 0;
-        text-align: center;
-        transition: all 0.3s ease;
-    }
-
-    .uploadfile:hover {
-        border-color: var(--secondary-green);
-        background: #F8FFF8;
-        transform: translateY(-2px);
-    }
-
-    /* Results Container */
-    .results-container {
-        background: white;
-        padding: calc(var(--spacing-unit) * 2);
-        border-radius: var(--border-radius);
-        box-shadow: var(--shadow);
-        margin: calc(var(--spacing-unit) * 2) 0;
-        color: var(--text-color);
-    }
-
-    /* Tabs Styling */
-    .stTabs {
-        background: white;
-        padding: var(--spacing-unit);
-        border-radius: var(--border-radius);
-        box-shadow: var(--shadow);
-    }
-
-    .stTabs [data-baseweb="tab-list"] {
-        background: #f8f9fa;
-        padding: calc(var(--spacing-unit) * 0.5);
-        border-radius: calc(var(--border-radius) * 0.75);
-        gap: calc(var(--spacing-unit) * 0.5);
-    }
-
-    .stTabs [data-baseweb="tab"] {
-        background: white;
-        color: var(--primary-green);
-        padding: calc(var(--spacing-unit) * 0.75) calc(var(--spacing-unit) * 1.5);
-        border-radius: calc(var(--border-radius) * 0.5);
-        font-weight: 600;
-        transition: all 0.3s ease;
-    }
-
-    .stTabs [data-baseweb="tab"][aria-selected="true"] {
-        background: var(--primary-green);
-        color: white;
-        transform: translateY(-2px);
-    }
-
-    /* Chat Interface */
-    .chat-container {
-        background: white;
-        padding: calc(var(--spacing-unit) * 2);
-        border-radius: var(--border-radius);
-        box-shadow: var(--shadow);
-        margin: calc(var(--spacing-unit) * 2) 0;
-    }
-
-    .chat-message {
-        padding: calc(var(--spacing-unit) * 1.5);
-        border-radius: calc(var(--border-radius) * 0.75);
-        margin-bottom: var(--spacing-unit);
-        display: flex;
-        align-items: start;
-        gap: var(--spacing-unit);
-    }
-
-    .user-message {
-        background: #E8F5E9;
-        margin-left: calc(var(--spacing-unit) * 2);
-        border-top-left-radius: calc(var(--border-radius) * 0.25);
-    }
-
-    .bot-message {
-        background: #F5F9F5;
-        margin-right: calc(var(--spacing-unit) * 2);
-        border-top-right-radius: calc(var(--border-radius) * 0.25);
-    }
+# Pipeline results for recent uploads, keyed by image content hash
+if 'pipeline_results' not in st.session_state:
+    st.session_state.pipeline_results = {}
+
+# How many uploads to keep stage results for in a session
+MAX_STORED_UPLOADS = 3
+
+# Custom styles live in a static asset instead of being rebuilt on every run
+STYLESHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "ecoscan.css")
+
+@st.cache_resource
+def load_stylesheet():
+    """Read and minify the stylesheet once per process; returns (css, version)"""
+    with open(STYLESHEET_PATH, encoding="utf-8") as f:
+        css = f.read()
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css).strip()
+    return css, hashlib.sha256(css.encode("utf-8")).hexdigest()[:12]
+
+def inject_styles():
+    css, version = load_stylesheet()
+    if st.get_option("server.enableStaticServing"):
+        # The browser fetches and caches the file, so reruns only send this tag
+        st.markdown(f'<link rel="stylesheet" href="app/static/ecoscan.css?v={version}">', unsafe_allow_html=True)
+    else:
+        st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
 
-    /* Buttons and Interactive Elements */
-    .stButton > button {
-        background: linear-gradient(135deg, var(--primary-green) 0%, var(--secondary-green) 100%);
-        color: white;
-        padding: calc(var(--spacing-unit) * 0.75) calc(var(--spacing-unit) * 2);
-        border-radius: calc(var(--border-radius) * 1.5);
-        font-weight: 600;
-        border: none;
-        transition: all 0.3s ease;
-    }
+inject_styles()
 
-    .stButton > button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-    }
+# Add Material Icons for category icons
+st.markdown("""
+    <link href="https://fonts.googleapis.com/icon?family=Material+Icons" rel="stylesheet">
+""", unsafe_allow_html=True)
 
-    /* Image Display */
-    .stImage {
-        background: white;
-        padding: var(--spacing-unit);
-        border-radius: var(--border-radius);
-        box-shadow: var(--shadow);
-        margin: calc(var(--spacing-unit) * 2) 0;
-    }
+def display_chat_message(message, is_user=True):
+    avatar = "👤" if is_user else "🌱"
+    alignment = "user-message" if is_user else "bot-message"
+    
+    st.markdown(f"""
+        <div class='chat-message {alignment}'>
+            <div class='message-avatar'>{avatar}</div>
+            <div class='message-content'>{message}</div>
+        </div>
+    """, unsafe_allow_html=True)
 
-    .stImage img {
-        border-radius: calc(var(--border-radius) * 0.5);
-        width: 100%;
-        height: auto;
-    }
+def format_image_stats(stats):
+    """Describe the upload savings and timings of a scan in one line"""
+    if stats.get('reencoded', True):
+        saved = stats['bytes_saved'] / stats['original_bytes'] * 100 if stats['original_bytes'] else 0
+        summary = (
+            f"Image sent as {stats['encoded_size'][0]}x{stats['encoded_size'][1]}: "
+            f"{stats['original_bytes'] / 1024:.0f} KB → {stats['encoded_bytes'] / 1024:.0f} KB "
+            f"({saved:.0f}% smaller), prep {stats['preprocess_ms']:.0f} ms"
+        )
+        if 'latency_saved_ms' in stats:
+            summary += f", ~{stats['latency_saved_ms']:.0f} ms faster per call"
+    else:
+        summary = f"Image sent as uploaded ({stats['encoded_bytes'] / 1024:.0f} KB), prep {stats['preprocess_ms']:.0f} ms"
+    if 'detection_ms' in stats:
+        summary += f", detection {stats['detection_ms']:.0f} ms"
+    return summary
+
+# Per-upload pipeline result store
+def get_pipeline_results(image_bytes):
+    """Return the stage results stored for this upload in the current session"""
+    key = hashlib.sha256(image_bytes).hexdigest()
+    store = st.session_state.pipeline_results
+    
+    if key in store:
+        # Move to the end so the most recently used uploads are kept
+        store[key] = store.pop(key)
+    else:
+        store[key] = {}
+        while len(store) > MAX_STORED_UPLOADS:
+            store.pop(next(iter(store)))
+    return store[key]
+
+def run_stage(results, stage, func, *args):
+    """Run a pipeline stage once per upload and reuse its output on reruns"""
+    if results.get(stage) is not None:
+        return results[stage]
+    
+    # Failed stages return None and are retried on the next run
+    output = func(*args)
+    if output is not None:
+        results[stage] = output
+    return output
+
+def run_voice_stage(recycling_advice, results, clips=None):
+    """Summarize the recycling guide and synthesize it; chained after the guide stage"""
+    if not recycling_advice:
+        return None
+    if not ELEVENLABS_AVAILABLE:
+        return (None, None)
+    
+    # Start speaking before the summary is finished when no audio is stored yet;
+    # a summary stored by an earlier run is reused rather than regenerated
+    if VOICE_PIPELINE and clips is not None and results.get('audio') is None and init_elevenlabs():
+        summary, audio = pipeline_voice_guidance(recycling_advice, clips, results.get('summary'))
+        if summary:
+            results['summary'] = summary
+        if audio:
+            results['audio'] = audio
+        return (summary, audio)
+    
+    summary = run_stage(results, 'summary', create_voice_summary, recycling_advice)
+    audio = run_stage(results, 'audio', generate_voice_guidance, summary) if summary else None
+    return (summary, audio)
 
-    /* Desktop Layout */
-    @media (min-width: 992px) {
-        .desktop-layout {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: calc(var(--spacing-unit) * 2);
-            align-items: start;
-        }
+def start_stage(results, stage, func, *args, streamed=False, after=None):
+    """Start a stage at most once per upload; returns its (future, partial chunks)
+    
+    Reruns get the running future back instead of starting the stage again, so
+    switching tabs mid-stream keeps drawing the same output. Streamed stages get
+    the chunk list appended to their arguments. A stage that needs another
+    stage's output passes that stage's future as after and gets its result as
+    the first argument once it is done.
+    """
+    running = results.setdefault('running', {})
+    entry = running.get(stage)
+    # Failed stages return None and are started again
+    if entry is None or (entry[0].done() and (entry[0].cancelled() or entry[0].exception() is not None or entry[0].result() is None)):
+        partial = []
+        args = (*args, *([partial] if streamed else []))
+        if after is not None:
+            future = submit_after(after, func, *args)
+        else:
+            future = get_stage_executor().submit(func, *args)
+        entry = running[stage] = (future, partial)
+    return entry
+
+def start_guide_stages(results, items):
+    """Start the Recycling Guide tab's stages: the guide and its voice summary"""
+    # Prompts name the items as detected; canonical IDs only key the metrics cache
+    names = prompt_item_names(items)
+    instructions = start_stage(results, 'instructions', run_stage, results, 'instructions', get_recycling_instructions, ", ".join(names), streamed=True)
+    voice = start_stage(results, 'voice', run_voice_stage, results, streamed=True, after=instructions[0])
+    return {'instructions': instructions, 'voice': voice}
+
+def start_impact_stages(results, items):
+    """Start the Environmental Impact tab's stages: the metrics charts and the analysis"""
+    names = prompt_item_names(items)
+    return {
+        'metrics': start_stage(results, 'metrics', run_stage, results, 'metrics', get_environmental_metrics, items),
+        'impact': start_stage(results, 'impact', run_stage, results, 'impact', get_environmental_impact, names, streamed=True),
+    }
+
+def render_stages(stages, slots, partials=None, appenders=None):
+    """Draw each stage into its slot as it finishes, showing streamed output meanwhile
+    
+    Partial text is redrawn in the stage's slot. Stages listed in appenders get
+    only their new chunks passed to the appender, so earlier output stays put.
+    """
+    partials = partials or {}
+    appenders = appenders or {}
+    futures = {future: stage for stage, future in stages.items()}
+    outputs = {}
+    drawn = {}
+    pending = set(futures)
+    
+    while pending:
+        done, pending = wait(pending, timeout=STREAM_REFRESH_SECONDS, return_when=FIRST_COMPLETED)
+        for stage, append in appenders.items():
+            chunks = partials.get(stage, [])
+            if len(chunks) > drawn.get(stage, 0):
+                append(chunks[drawn.get(stage, 0):len(chunks)])
+                drawn[stage] = len(chunks)
+        
+        for future in done:
+            stage = futures[future]
+            slot, _, render = slots[stage]
+            outputs[stage] = future.result()
+            
+            if outputs[stage]:
+                with slot.container():
+                    render(outputs[stage])
+            else:
+                slot.empty()
+        
+        # Redraw stages that have streamed new text since the last pass
+        for future in pending:
+            stage = futures[future]
+            if stage in appenders:
+                continue
+            chunks = partials.get(stage)
+            if chunks and len(chunks) != drawn.get(stage):
+                drawn[stage] = len(chunks)
+                slot, _, render = slots[stage]
+                with slot.container():
+                    render("".join(chunks))
+    return outputs
+
+def render_simple_guide(instructions):
+    # Display results in a more engaging way
+    st.markdown(f"""
+        <div style='background: linear-gradient(135deg, #E8F5E9 0%, #C8E6C9 100%); 
+                  padding: 2rem; 
+                  border-radius: 12px; 
+                  margin-top: 1rem; 
+                  box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
+            <h3 style='color: #2E7D32; margin-bottom: 1rem; text-align: center;'>♻️ Your Recycling Guide</h3>
+            <div style='background: white; padding: 1.5rem; border-radius: 8px; margin-bottom: 1.5rem; color: #000000;'>
+                {instructions}
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
 
-        .full-width {
-            grid-column: 1 / -1;
-        }
-    }
+def render_recycling_guide(recycling_advice):
+    st.markdown(f"""
+        <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
+            <h3 style='color: var(--primary-green);'>♻️ Recycling Guide</h3>
+            <div style='color: #000000;'>
+                {recycling_advice}
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
 
-    /* Mobile Adjustments */
-    @media (max-width: 991px) {
-        :root {
-            --spacing-unit: 0.75rem;
-        }
+# Plays streamed sentence clips back to back. The queue and player live in the
+# page rather than the component iframe, so playback continues across iframes
+# and reruns, and clips already queued once are not played again.
+VOICE_QUEUE_SCRIPT = """
+<script>
+const page = window.parent;
+const queue = page.ecoscanVoice || (page.ecoscanVoice = {seen: new page.Set(), clips: [], playing: false});
+if (!queue.play) {
+    queue.play = new page.Function("queue", `
+        if (queue.playing || !queue.clips.length) return;
+        queue.playing = true;
+        const audio = new Audio(queue.clips.shift());
+        audio.onended = audio.onerror = () => { queue.playing = false; queue.play(queue); };
+        audio.play().catch(() => { queue.playing = false; queue.clips.length = 0; });
+    `);
+}
+for (const [id, src] of CLIPS) {
+    if (!queue.seen.has(id)) {
+        queue.seen.add(id);
+        queue.clips.push(src);
+    }
+}
+queue.play(queue);
+</script>
+"""
+
+def queue_voice_clips(clips, first_index, playlist):
+    """Autoplay sentence clips in order as they arrive, without a player per clip"""
+    entries = [
+        [f"{playlist}:{first_index + offset}", "data:audio/mpeg;base64," + base64.b64encode(clip).decode("ascii")]
+        for offset, clip in enumerate(clips) if clip
+    ]
+    if entries:
+        components.html(VOICE_QUEUE_SCRIPT.replace("CLIPS", json.dumps(entries)), height=0)
+
+def voice_clip_appender(results, container):
+    """Appender for render_stages that queues new voice clips for playback"""
+    playlist = results.setdefault('voice_playlist', uuid.uuid4().hex)
+    queued = 0
+    
+    def append(clips):
+        nonlocal queued
+        with container:
+            queue_voice_clips(clips, queued, playlist)
+        queued += len(clips)
+    return append
+
+def render_voice_guidance(voice):
+    # Voice guidance section; service details are in the diagnostics panel
+    st.markdown("### 🎧 Voice Guidance")
+    
+    if not ELEVENLABS_AVAILABLE:
+        st.error("Voice guidance is currently disabled. ElevenLabs package not available.")
+        return
+    
+    summary, audio = voice
+    if summary:
+        st.markdown(f"_{summary}_")
+        if audio:
+            # One player for the whole summary; streamed clips play through the queue
+            st.audio(audio, format='audio/mp3')
+        else:
+            st.error("Failed to generate audio")
+    else:
+        st.error("Failed to create summary")
+
+# Built Plotly figures shared across sessions, keyed by chart and data hash
+MAX_CACHED_FIGURES = 64
+
+@st.cache_resource
+def get_figure_cache():
+    """Process-wide figure cache with hit/miss counters and build time saved"""
+    return {"figures": OrderedDict(), "lock": threading.Lock(), "hits": 0, "misses": 0, "saved_ms": 0.0}
+
+def get_figure_cache_stats():
+    cache = get_figure_cache()
+    return {
+        "figures": len(cache["figures"]),
+        "hits": cache["hits"],
+        "misses": cache["misses"],
+        "saved_ms": round(cache["saved_ms"], 1),
+    }
+
+def cached_figure(chart, data, build):
+    """Return build(data), reusing the figure built for identical data earlier"""
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    key = (chart, digest)
+    cache = get_figure_cache()
+    with cache["lock"]:
+        entry = cache["figures"].get(key)
+        if entry is not None:
+            cache["figures"].move_to_end(key)
+            cache["hits"] += 1
+            cache["saved_ms"] += entry[1]
+    record_cache("figures", entry is not None)
+    if entry is not None:
+        return entry[0]
+
+    start = time.perf_counter()
+    fig = build(data)
+    build_ms = (time.perf_counter() - start) * 1000
+    with cache["lock"]:
+        cache["misses"] += 1
+        cache["figures"][key] = (fig, build_ms)
+        while len(cache["figures"]) > MAX_CACHED_FIGURES:
+            cache["figures"].popitem(last=False)
+    return fig
+
+def build_carbon_figure(carbon_data):
+    import plotly.express as px
+    return px.pie(
+        values=list(carbon_data.values()),
+        names=list(carbon_data.keys()),
+        title='CO₂ Emissions by Stage (kg)',
+        color_discrete_sequence=px.colors.sequential.Greens
+    )
 
-        .header-container h1 {
-            font-size: 2rem;
-        }
+def build_water_figure(water_data):
+    import plotly.express as px
+    return px.bar(
+        x=list(water_data.keys()),
+        y=list(water_data.values()),
+        title='Water Consumption (Liters)',
+        color_discrete_sequence=px.colors.sequential.Blues
+    )
 
-        .stApp {
-            padding: var(--spacing-unit);
+def build_energy_figure(percentage_saved):
+    import plotly.graph_objects as go
+    return go.Figure(go.Indicator(
+        mode = "gauge+number",
+        value = percentage_saved,
+        title = {'text': "Energy Savings vs. New Production"},
+        gauge = {
+            'axis': {'range': [0, 100]},
+            'bar': {'color': "#2E7D32"},
+            'steps': [
+                {'range': [0, 33], 'color': "#E8F5E9"},
+                {'range': [33, 66], 'color': "#A5D6A7"},
+                {'range': [66, 100], 'color': "#4CAF50"}
+            ]
         }
-    }
-
-    /* Loading States */
-    .stSpinner {
-        display: flex;
-        justify-content: center;
-        margin: calc(var(--spacing-unit) * 2) 0;
-    }
-
-    .stSpinner > div {
-        border-top-color: var(--primary-green) !important;
-    }
-
-    /* Alerts and Messages */
-    .stAlert {
-        border-radius: var(--border-radius);
-        margin: var(--spacing-unit) 0;
-        padding: calc(var(--spacing-unit) * 1.25);
-    }
-
-    /* Radio Buttons */
-    .stRadio > div {
-        display: flex;
-        gap: calc(var(--spacing-unit) * 0.5);
-    }
-
-    .stRadio label {
-        background: white;
-        padding: calc(var(--spacing-unit) * 0.75) calc(var(--spacing-unit) * 1.5);
-        border-radius: calc(var(--border-radius) * 0.75);
-        font-weight: 600;
-        transition: all 0.3s ease;
-    }
-
-    .stRadio label:hover {
-        background: #f8f9fa;
-        transform: translateY(-2px);
-    }
-
-    /* Footer and Sponsor Section */
-    .footer-section {
-        margin-top: calc(var(--spacing-unit) * 3);
-        padding: calc(var(--spacing-unit) * 2);
-        background: white;
-        border-radius: var(--border-radius);
-        box-shadow: var(--shadow);
-    }
-
-    .footer-content {
-        display: grid;
-        grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-        gap: calc(var(--spacing-unit) * 2);
-        margin-bottom: calc(var(--spacing-unit) * 2);
-    }
-
-    .footer-column {
-        text-align: center;
-    }
+    ))
+
+def build_benefits_figure(benefits):
+    import plotly.express as px
+    fig = px.bar(
+        x=list(benefits.keys()),
+        y=list(benefits.values()),
+        title='Positive Environmental Impact',
+        color_discrete_sequence=px.colors.sequential.Greens
+    )
+    fig.update_layout(showlegend=False)
+    return fig
 
-    .footer-column h4 {
-        color: var(--primary-green);
-        margin-bottom: calc(var(--spacing-unit) * 0.75);
-        font-size: 1.2rem;
-    }
+def render_environmental_metrics(metrics):
+    # Create columns for the visualizations
+    col1, col2 = st.columns(2)
 
-    .sponsor-logos {
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        gap: calc(var(--spacing-unit) * 2);
-    }
+    with col1:
+        # Carbon Footprint Breakdown
+        st.markdown("""
+            <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow); margin-bottom: 1rem;'>
+                <h4 style='color: var(--primary-green);'>🏭 Carbon Footprint Breakdown</h4>
+        """, unsafe_allow_html=True)
 
-    .sponsor-logos img {
-        height: 40px;
-        transition: all 0.3s ease;
-    }
+        # Create a pie chart for carbon footprint
+        fig = cached_figure("carbon", metrics['carbon_footprint'], build_carbon_figure)
+        st.plotly_chart(fig, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
 
-    .sponsor-logos img:hover {
-        transform: scale(1.1);
-    }
+        # Water Usage Comparison
+        st.markdown("""
+            <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
+                <h4 style='color: var(--primary-green);'>💧 Water Usage Impact</h4>
+        """, unsafe_allow_html=True)
 
-    .github-link {
-        display: inline-flex;
-        align-items: center;
-        gap: 0.5rem;
-        padding: 0.75rem 1.5rem;
-        background: #24292e;
-        color: white;
-        text-decoration: none;
-        border-radius: calc(var(--border-radius) * 0.5);
-        font-weight: 600;
-        transition: all 0.3s ease;
-        margin-top: 1rem;
-    }
+        fig = cached_figure("water", metrics['water_usage'], build_water_figure)
+        st.plotly_chart(fig, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
 
-    .github-link:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 8px rgba(0,0,0,0.2);
-        background: #2f363d;
-    }
+    with col2:
+        # Energy Savings
+        st.markdown("""
+            <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow); margin-bottom: 1rem;'>
+                <h4 style='color: var(--primary-green);'>⚡ Energy Impact</h4>
+        """, unsafe_allow_html=True)
 
-    .github-link img {
-        width: 24px;
-        height: 24px;
-    }
+        percentage_saved = metrics['energy_savings']['percentage_saved']
+        fig = cached_figure("energy", percentage_saved, build_energy_figure)
+        st.plotly_chart(fig, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
 
-    /* Message Content */
-    .message-content {
-        color: var(--text-color);
-    }
+        # Recycling Benefits
+        st.markdown("""
+            <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
+                <h4 style='color: var(--primary-green);'>🌱 Environmental Benefits</h4>
+        """, unsafe_allow_html=True)
 
-    /* Text in white containers */
-    div[style*="background: white"] {
-        color: var(--text-color);
-    }
+        fig = cached_figure("benefits", metrics['recycling_benefits'], build_benefits_figure)
+        st.plotly_chart(fig, use_container_width=True)
+        st.markdown("</div>", unsafe_allow_html=True)
 
-    /* Ensure text is visible in recycling guide */
-    div[style*="background: white"] p,
-    div[style*="background: white"] li,
-    div[style*="background: white"] span {
-        color: var(--text-color) !important;
-    }
+    # Additional metrics display
+    st.markdown("""
+        <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow); margin-top: 1rem;'>
+            <h4 style='color: var(--primary-green);'>📊 Additional Impact Metrics</h4>
+            <div style='display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 1rem; margin-top: 1rem;'>
+    """, unsafe_allow_html=True)
 
-    /* Chat messages */
-    .chat-message .message-content {
-        color: var(--text-color);
-    }
-    </style>
+    # Display landfill impact
+    landfill = metrics['landfill_impact']
+    st.markdown(f"""
+        <div style='background: #F1F8E9; padding: 1rem; border-radius: 8px;'>
+            <h5 style='color: #2E7D32; margin-bottom: 0.5rem;'>Landfill Impact</h5>
+            <p>Volume: {landfill['volume']:.2f} m³</p>
+            <p>Decomposition: {landfill['decomposition_time']:.1f} years</p>
+        </div>
     """, unsafe_allow_html=True)
 
-# Add Material Icons for category icons
-st.markdown("""
-    <link href="https://fonts.googleapis.com/icon?family=Material+Icons" rel="stylesheet">
-""", unsafe_allow_html=True)
+    st.markdown("</div></div>", unsafe_allow_html=True)
 
-# Initialize Gemini
-def init_gemini():
-    try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            st.error("Google API key not found. Please set the GOOGLE_API_KEY environment variable.")
-            return None
-            
-        genai.configure(api_key=api_key)
-        
-        # Configure generation parameters
-        generation_config = {
-            "temperature": 0.1,  # Lower temperature for more focused responses
-            "top_p": 1,
-            "top_k": 32,
-            "max_output_tokens": 1024,
-        }
-        
-        # Create the model
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            generation_config=generation_config
+    parse_stats = get_metrics_parse_stats()
+    if parse_stats['responses']:
+        st.caption(
+            f"Metrics responses: {parse_stats['responses']}, "
+            f"repaired locally: {parse_stats['repaired']}, "
+            f"failed: {parse_stats['failed'] / parse_stats['responses']:.0%}"
         )
-        return model
-    except Exception as e:
-        st.error(f"Error initializing Gemini: {str(e)}")
-        return None
 
-# Image recognition function
-def analyze_image(image_bytes):
-    model = init_gemini()
-    if not model:
-        return None
-    
-    try:
-        # Convert bytes to PIL Image
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Prepare the image for Gemini
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        # Generate content about the image
-        prompt = """You are a recycling expert analyzing this image. Your task is to:
-        1. Identify all visible objects that could be recycled or need special disposal
-        2. Focus on materials like plastic, metal, glass, electronics, paper, etc.
-        3. Be specific about the materials (e.g., "plastic water bottle" rather than just "bottle")
-        4. List each item separately, separated by commas
-        
-        Format your response as a simple comma-separated list without explanations or bullets.
-        Example format: plastic water bottle, aluminum can, glass jar
-        
-        What recyclable or disposable items do you see in this image?"""
-        
-        response = model.generate_content([prompt, image])
-        response.resolve()
-        
-        # Extract items from response and clean up
-        text = response.text.strip()
-        if not text:
-            prompt = "List all visible objects in this image that could be recycled or need disposal, separated by commas:"
-            response = model.generate_content([prompt, image])
-            response.resolve()
-            text = response.text.strip()
-        
-        # Split and clean items
-        items = [item.strip() for item in text.split(',')]
-        items = [item for item in items if item and not item.lower().startswith('i see') and not item.lower().startswith('there')]
-        
-        if not items:
-            prompt = "What objects do you see in this image? List them with commas:"
-            response = model.generate_content([prompt, image])
-            response.resolve()
-            items = [item.strip() for item in response.text.strip().split(',')]
-        
-        return [item for item in items if item]
-    except Exception:
-        return None
+def render_environmental_impact(environmental_impact):
+    st.markdown("""
+        <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
+            <h3 style='color: var(--primary-green);'>🌍 Environmental Impact Analysis</h3>
+            {}
+        </div>
+    """.format(environmental_impact), unsafe_allow_html=True)
+
+def render_diagnostics():
+    """Per-stage timings, tokens, bytes and cache results plus gateway state"""
+    with st.expander("🩺 Diagnostics"):
+        tts_stats = get_tts_cache_stats()
+        st.caption(
+            f"ElevenLabs available: {ELEVENLABS_AVAILABLE} · "
+            f"API key set: {bool(os.getenv('ELEVENLABS_API_KEY'))} · "
+            f"Audio cache: {tts_stats['hits']} hits, {tts_stats['misses']} misses, {tts_stats['evictions']} evictions"
+        )
+        figure_stats = get_figure_cache_stats()
+        st.caption(
+            f"Chart cache: {figure_stats['hits']} hits, {figure_stats['misses']} misses, "
+            f"{figure_stats['saved_ms']:.0f} ms of figure building saved"
+        )
+        rows = stage_stats()
+        if rows:
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+        else:
+            st.caption("No upstream calls recorded yet.")
+        st.json({"gateway": gateway_stats(), "coalescing": single_flight_stats()}, expanded=False)
+
+def format_chat_usage(usage):
+    if 'prompt_tokens' in usage:
+        return f"{usage['prompt_tokens']} tokens sent, {usage['output_tokens']} received"
+    return f"~{usage.get('estimated_prompt_tokens', 0)} tokens sent"
+
+@st.fragment
+def render_chat(items, recycling_advice, environmental_impact):
+    # Chat interface section; a message or clear reruns only this fragment
+    st.markdown("<h3>💬 Chat with EcoBot</h3>", unsafe_allow_html=True)
+
+    if 'messages' not in st.session_state:
+        st.session_state.messages = []
+
+    if st.button("Clear Chat History", key="clear_chat"):
+        st.session_state.messages = []
+        st.session_state.thinking = False
+
+    for message in st.session_state.messages:
+        display_chat_message(message['text'], message['is_user'])
+        if message.get('usage'):
+            st.caption(format_chat_usage(message['usage']))
+
+    if 'thinking' not in st.session_state:
+        st.session_state.thinking = False
+
+    user_message = st.chat_input(
+        "Ask about recycling and sustainability",
+        key="chat_input",
+        disabled=st.session_state.thinking
+    )
 
-# Generate recycling advice
-def get_recycling_advice(item_description):
-    model = init_gemini()
-    if not model:
-        return None
+    if user_message:
+        if not st.session_state.thinking:
+            st.session_state.thinking = True
+            st.session_state.messages.append({"text": user_message, "is_user": True})
+            display_chat_message(user_message, True)
+
+            with st.spinner("EcoBot is thinking..."):
+                history_budget = CHAT_TOKEN_BUDGET - int(CHAT_TOKEN_BUDGET * CHAT_CONTEXT_SHARE)
+                context = build_chat_history(st.session_state.messages[:-1], history_budget)
+
+                # Stream the reply into the chat as it is generated
+                partial = []
+                usage = {}
+                reply = get_stage_executor().submit(
+                    get_chatbot_response,
+                    user_message,
+                    context=context,
+                    items=items,
+                    recycling_advice=recycling_advice,
+                    environmental_impact=environmental_impact,
+                    partial=partial,
+                    usage=usage
+                )
+                reply_slot = st.empty()
+                outputs = render_stages(
+                    {'reply': reply},
+                    {'reply': (reply_slot, None, lambda text: display_chat_message(text, is_user=False))},
+                    {'reply': partial}
+                )
+                bot_response = outputs['reply']
+            if usage:
+                st.caption(format_chat_usage(usage))
+
+            st.session_state.messages.append({"text": bot_response, "is_user": False, "usage": usage})
+            st.session_state.thinking = False
+
+@st.fragment
+def render_analysis_tabs(results, detections, items):
+    """Advanced-mode result tabs
     
-    try:
-        prompt = f"""As an expert in recycling and environmental sustainability, provide detailed guidance for recycling these items: {item_description}.
-        
-        Format your response with these EXACT sections and bullet points:
-
-        1. Preparation Steps:
-        • Clean and rinse all items thoroughly
-        • Remove any non-recyclable parts
-        • Separate different materials
-        • Flatten or compress items if applicable
-
-        2. Recycling/Disposal Options:
-        • Curbside recycling instructions
-        • Local recycling center locations
-        • Special handling requirements
-        • Alternative disposal methods
-
-        3. Environmental Impact:
-        • Material recovery benefits
-        • Energy savings
-        • Pollution reduction
-        • Resource conservation
-
-        4. Additional Tips:
-        • Common recycling mistakes to avoid
-        • Best practices for sorting
-        • Local guidelines and requirements
-        • Storage recommendations
-
-        Provide specific, actionable details for each bullet point."""
-        
-        response = model.generate_content(prompt)
-        response.resolve()
-        return response.text
-    except Exception:
-        return None
-
-# Generate a concise summary for voice guidance
-def create_voice_summary(advice):
-    try:
-        model = init_gemini()
-        if not model:
-            return None
-            
-        prompt = """Create an enthusiastic and engaging 30-second summary (approximately 75 words) of the following recycling advice. 
-        Make it sound exciting and motivational, using an upbeat tone. Include encouraging phrases and positive reinforcement.
-        Focus on the most important preparation steps and disposal methods. Start with an energetic greeting and end with a motivational closer.
-        
-        Example style:
-        "Hey there, eco-warrior! Great news about recycling your [items]! Here's what you need to know... Remember, you're making a real difference!"
-
-        Advice to summarize:
-        {advice}"""
-        
-        response = model.generate_content(prompt.format(advice=advice))
-        response.resolve()
-        return response.text.strip()
-    except Exception:
-        return None
-
-# Generate voice guidance
-def generate_voice_guidance(text):
-    if not ELEVENLABS_AVAILABLE:
-        return None
-            
-    # Initialize ElevenLabs
-    if not init_elevenlabs():
-        return None
-            
-    try:
-        # Generate audio using ElevenLabs
-        audio = generate(
-            text=text,
-            voice="Antoni",
-            model="eleven_multilingual_v2"
+    Switching tabs reruns only this fragment. A tab's upstream calls start the
+    first time it is opened; tabs opened earlier keep showing their results.
+    """
+    items_tab, guide_tab, impact_tab = st.tabs(
+        ["Items Detected", "Recycling Guide", "Environmental Impact"],
+        key="result_tabs",
+        on_change="rerun"
+    )
+    running = results.get('running', {})
+    stages = {}
+    slots = {}
+    
+    with items_tab:
+        for detection in detections:
+            st.markdown(f"""
+                <div style='display: flex; align-items: center; margin: 0.5rem 0;'>
+                    <i class='material-icons category-icon'>eco</i>
+                    <span>{detection['name']}</span>
+                    <span style='margin-left: 0.75rem; color: #555555; font-size: 0.9rem;'>
+                        {detection['material']} · {detection['disposal_category']} · {detection['confidence']:.0%}
+                    </span>
+                </div>
+            """, unsafe_allow_html=True)
+        catalog_stats = canonicalization_stats()
+        st.caption(
+            f"Item catalog hit rate: {catalog_stats['hit_rate']:.0%} "
+            f"({catalog_stats['exact']} exact, {catalog_stats['fuzzy']} fuzzy, {catalog_stats['unmatched']} unmatched)"
         )
-        return audio if audio else None
-    except Exception:
-        return None
-
-# Add chat functionality
-def get_chatbot_response(user_message, context="", items=None, recycling_advice=None, environmental_impact=None):
-    try:
-        model = init_gemini()
-        if not model:
-            return "I'm having trouble connecting to the AI service. Please check your API key and try again."
-        
-        # Build comprehensive context
-        full_context = []
-        if items:
-            full_context.append(f"Detected items in image: {', '.join(items)}")
-        if recycling_advice:
-            full_context.append(f"Recycling advice: {recycling_advice}")
-        if environmental_impact:
-            full_context.append(f"Environmental impact: {environmental_impact}")
-        if context:
-            full_context.append(f"Previous conversation: {context}")
-            
-        combined_context = "\n\n".join(full_context)
-        
-        prompt = f"""You are EcoBot, an expert in recycling and environmental sustainability. Your goal is to provide helpful, practical advice about recycling and environmental topics.
-
-        Available Context:
-        {combined_context}
-        
-        User question: {user_message}
-        
-        Provide a clear, friendly, and practical response that:
-        1. Uses the available context about detected items and environmental impact when relevant
-        2. Includes specific, actionable steps when appropriate
-        3. Adds interesting environmental facts when appropriate
-        4. Maintains a helpful and encouraging tone
-        5. References specific items or advice from the context when applicable
-        
-        Keep your response concise but informative."""
-        
-        response = model.generate_content(prompt)
-        response.resolve()
-        return response.text.strip()
-    except Exception as e:
-        return f"I encountered an error while processing your request: {str(e)}\nPlease try rephrasing your question or try again later."
-
-def display_chat_message(message, is_user=True):
-    avatar = "👤" if is_user else "🌱"
-    alignment = "user-message" if is_user else "bot-message"
     
-    st.markdown(f"""
-        <div class='chat-message {alignment}'>
-            <div class='message-avatar'>{avatar}</div>
-            <div class='message-content'>{message}</div>
-        </div>
-    """, unsafe_allow_html=True)
-
-def get_recycling_instructions(items):
-    try:
-        model = init_gemini()
-        if not model:
-            return None
-            
-        prompt = f"""Create clear, step-by-step instructions for recycling these items: {items}.
-        Format the response as numbered steps with emoji indicators.
-        Include:
-        1. Basic preparation steps (cleaning, sorting)
-        2. Specific disposal instructions for each material
-        3. One key environmental fact
-        
-        Keep it simple and actionable, focusing on what the user needs to do right now.
-        Use friendly, encouraging language."""
-        
-        response = model.generate_content(prompt)
-        response.resolve()
-        return response.text.strip()
-    except Exception as e:
-        st.error(f"Error generating instructions: {str(e)}")
-        return None
-
-def get_environmental_metrics(items):
-    try:
-        model = init_gemini()
-        if not model:
-            return None
-            
-        prompt = f"""Analyze these items and provide environmental impact metrics: {', '.join(items)}
-        
-        Return the data in this EXACT JSON format:
-        {{
-            "carbon_footprint": {{
-                "manufacturing": float (in kg CO2),
-                "transportation": float (in kg CO2),
-                "disposal": float (in kg CO2)
-            }},
-            "water_usage": {{
-                "manufacturing": float (in liters),
-                "recycling": float (in liters)
-            }},
-            "energy_savings": {{
-                "recycling_vs_new": float (in kWh),
-                "percentage_saved": float (0-100)
-            }},
-            "landfill_impact": {{
-                "volume": float (in cubic meters),
-                "decomposition_time": float (in years)
-            }},
-            "recycling_benefits": {{
-                "trees_saved": float,
-                "water_saved": float (in liters),
-                "energy_saved": float (in kWh)
-            }}
-        }}
-        
-        Base the numbers on typical industry averages and environmental impact studies.
-        Use realistic values that would make sense for these specific items."""
-        
-        response = model.generate_content(prompt)
-        response.resolve()
-        
-        # Convert the response to a Python dictionary
-        import json
-        try:
-            metrics = json.loads(response.text)
-            return metrics
-        except json.JSONDecodeError:
-            return None
-    except Exception:
-        return None
+    # Reserve a slot for each started stage so results show up as they finish
+    if guide_tab.open or 'instructions' in running:
+        stages.update(start_guide_stages(results, items))
+        with guide_tab:
+            guide_slot = st.empty()
+            voice_slot = st.empty()
+            voice_clips = st.container()
+        slots['instructions'] = (guide_slot, "♻️ Preparing your recycling guide...", render_recycling_guide)
+        slots['voice'] = (voice_slot, "🎧 Generating voice guidance...", render_voice_guidance)
+    
+    if impact_tab.open or 'metrics' in running:
+        stages.update(start_impact_stages(results, items))
+        with impact_tab:
+            metrics_slot = st.empty()
+            impact_slot = st.empty()
+            chat_container = st.container()
+        slots['metrics'] = (metrics_slot, "📊 Calculating environmental metrics...", render_environmental_metrics)
+        slots['impact'] = (impact_slot, "🌍 Analyzing environmental impact...", render_environmental_impact)
+    
+    for stage, (slot, message, _) in slots.items():
+        slot.info(message)
+    
+    appenders = {}
+    if 'voice' in stages:
+        appenders['voice'] = voice_clip_appender(results, voice_clips)
+    
+    outputs = render_stages(
+        {stage: future for stage, (future, _) in stages.items()},
+        slots,
+        {stage: partial for stage, (_, partial) in stages.items()},
+        appenders
+    )
+    
+    if outputs.get('impact'):
+        with chat_container:
+            # The guide is only part of the chat context once its tab has been opened
+            render_chat(items, results.get('instructions'), outputs['impact'])
 
 # Main app
 def main():
-    # Configure page layout for better responsiveness
-    st.markdown("""
-        <style>
-        /* Main Container */
-        .block-container {
-            max-width: 1400px;
-            padding: 2rem 3rem;
-            margin: 0 auto;
-        }
-        
-        /* Header Styling */
-        .header-container {
-            text-align: center;
-            margin-bottom: 2rem;
-            padding: 1rem;
-            background: #f8f9fa;
-            border-radius: 10px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }
-        
-        /* Mode Selector Styling */
-        .mode-selector {
-            display: flex;
-            justify-content: center;
-            gap: 1rem;
-            margin: 1rem 0;
-            padding: 0.5rem;
-            background: white;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }
-        
-        /* Improve image display */
-        .stImage {
-            margin: 1rem 0;
-        }
-        
-        .stImage > img {
-            max-width: 100%;
-            height: auto;
-            border-radius: 10px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }
-        
-        /* Tabs styling */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 1rem;
-            background: white;
-            padding: 0.5rem;
-            border-radius: 8px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-        }
-        
-        .stTabs [data-baseweb="tab"] {
-            height: auto;
-            padding: 0.75rem 1.5rem;
-            background: #f8f9fa;
-            border-radius: 6px;
-            border: none;
-            color: #2E7D32;
-            font-weight: 600;
-        }
-        
-        .stTabs [data-baseweb="tab"][aria-selected="true"] {
-            background: #2E7D32;
-            color: white;
-        }
-        
-        /* Results container */
-        .results-container {
-            background: white;
-            padding: 2rem;
-            border-radius: 10px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            margin: 1rem 0;
-        }
-        
-        /* Desktop specific styles */
-        @media (min-width: 992px) {
-            .desktop-layout {
-                display: grid;
-                grid-template-columns: 1fr 1fr;
-                gap: 2rem;
-                align-items: start;
-            }
-            
-            .full-width {
-                grid-column: 1 / -1;
-            }
-            
-            .stRadio > div {
-                flex-direction: row !important;
-                gap: 2rem;
-            }
-            
-            .stRadio label {
-                padding: 1rem 2rem !important;
-                background: #f8f9fa;
-                border-radius: 8px;
-                text-align: center;
-                font-weight: 600;
-            }
-            
-            .stRadio label:hover {
-                background: #e9ecef;
-            }
-        }
-        
-        /* Mobile specific styles */
-        @media (max-width: 991px) {
-            .block-container {
-                padding: 1rem;
-            }
-            
-            .stRadio > div {
-                flex-direction: column !important;
-            }
-            
-            .stRadio label {
-                margin: 0.5rem 0 !important;
-            }
-        }
-        </style>
-    """, unsafe_allow_html=True)
-
     # Header section with improved visibility
     st.markdown("""
         <div class="header-container">
@@ -919,49 +724,53 @@ def main():
     )
 
     if uploaded_file:
+        if not os.getenv("GOOGLE_API_KEY"):
+            st.error("Google API key not found. Please set the GOOGLE_API_KEY environment variable.")
+        
         if st.session_state.mode == 'simple':
             # Create a container for the image and results
             st.markdown('<div style="background: white; padding: 2rem; border-radius: 12px; box-shadow: var(--shadow);">', unsafe_allow_html=True)
             
             # Display image in a more attractive way
-            image = Image.open(uploaded_file)
-            st.image(image, width=600)
+            st.image(uploaded_file, width=600)
             
             with st.spinner("🔍 Analyzing your items..."):
                 image_bytes = uploaded_file.getvalue()
-                items = analyze_image(image_bytes)
+                results = get_pipeline_results(image_bytes)
+                image_stats = results.setdefault('image_stats', {})
+                detections = run_stage(results, 'detections', detect_items, image_bytes, image_stats)
+                items = [detection['name'] for detection in detections] if detections else None
                 
                 if items:
-                    instructions = get_recycling_instructions(", ".join(items))
+                    # Stream the guide into the page while it is generated
+                    partial = []
+                    guide = get_stage_executor().submit(run_stage, results, 'instructions', get_recycling_instructions, ", ".join(prompt_item_names(items)), partial)
+                    guide_slot = st.empty()
+                    instructions = render_stages(
+                        {'instructions': guide},
+                        {'instructions': (guide_slot, None, render_simple_guide)},
+                        {'instructions': partial}
+                    )['instructions']
                     if instructions:
-                        # Create a summary for voice guidance
-                        summary = create_voice_summary(instructions)
-                        
-                        # Display results in a more engaging way
-                        st.markdown(f"""
-                            <div style='background: linear-gradient(135deg, #E8F5E9 0%, #C8E6C9 100%); 
-                                      padding: 2rem; 
-                                      border-radius: 12px; 
-                                      margin-top: 1rem; 
-                                      box-shadow: 0 2px 4px rgba(0,0,0,0.1);'>
-                                <h3 style='color: #2E7D32; margin-bottom: 1rem; text-align: center;'>♻️ Your Recycling Guide</h3>
-                                <div style='background: white; padding: 1.5rem; border-radius: 8px; margin-bottom: 1.5rem; color: #000000;'>
-                                    {instructions}
-                                </div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        
                         # Add voice guidance
-                        if summary:
+                        if ELEVENLABS_AVAILABLE:
                             st.markdown("""
                                 <div style='background: white; padding: 1.5rem; border-radius: 8px; margin-top: 1rem;'>
                                     <h4 style='color: #2E7D32; margin-bottom: 0.5rem;'>🎧 Listen to Instructions</h4>
                                 </div>
                             """, unsafe_allow_html=True)
                             
-                            audio = generate_voice_guidance(summary)
-                            if audio:
-                                st.audio(audio, format='audio/mp3')
+                            # Play each sentence as soon as it is synthesized
+                            clips = []
+                            voice = submit_after(guide, run_voice_stage, results, clips)
+                            audio_slot = st.empty()
+                            clip_container = st.container()
+                            render_stages(
+                                {'voice': voice},
+                                {'voice': (audio_slot, None, lambda voice: st.audio(voice[1], format='audio/mp3') if voice[1] else None)},
+                                {'voice': clips},
+                                {'voice': voice_clip_appender(results, clip_container)}
+                            )
                         
                         # Add a friendly call-to-action for advanced mode
                         st.markdown("""
@@ -979,15 +788,17 @@ def main():
             
             # Image column
             st.markdown('<div>', unsafe_allow_html=True)
-            image = Image.open(uploaded_file)
-            st.image(image, width=600)
+            st.image(uploaded_file, width=600)
             st.markdown('</div>', unsafe_allow_html=True)
             
             # Analysis column
             st.markdown('<div>', unsafe_allow_html=True)
             with st.spinner("🔍 Analyzing your item..."):
                 image_bytes = uploaded_file.getvalue()
-                items = analyze_image(image_bytes)
+                results = get_pipeline_results(image_bytes)
+                image_stats = results.setdefault('image_stats', {})
+                detections = run_stage(results, 'detections', detect_items, image_bytes, image_stats)
+                items = [detection['name'] for detection in detections] if detections else None
 
             if items:
                 st.markdown("""
@@ -995,6 +806,8 @@ def main():
                         <h2 style='color: #2E7D32;'>📋 Analysis Results</h2>
                     </div>
                 """, unsafe_allow_html=True)
+                if image_stats:
+                    st.caption(format_image_stats(image_stats))
             st.markdown('</div>', unsafe_allow_html=True)
             
             st.markdown('</div>', unsafe_allow_html=True)
@@ -1002,230 +815,13 @@ def main():
             # Full-width tabs section
             if items:
                 st.markdown('<div class="full-width">', unsafe_allow_html=True)
-                result_tab1, result_tab2, result_tab3 = st.tabs(["Items Detected", "Recycling Guide", "Environmental Impact"])
+                render_analysis_tabs(results, detections, items)
                 
-                with result_tab1:
-                    for item in items:
-                        st.markdown(f"""
-                            <div style='display: flex; align-items: center; margin: 0.5rem 0;'>
-                                <i class='material-icons category-icon'>eco</i>
-                                <span>{item}</span>
-                            </div>
-                        """, unsafe_allow_html=True)
-
-                with result_tab2:
-                    if items:
-                        recycling_advice = get_recycling_instructions(", ".join(items))
-                        if recycling_advice:
-                            st.markdown(f"""
-                                <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
-                                    <h3 style='color: var(--primary-green);'>♻️ Recycling Guide</h3>
-                                    <div style='color: #000000;'>
-                                        {recycling_advice}
-                                    </div>
-                                </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Voice guidance section with better error handling and debugging
-                            st.markdown("### 🎧 Voice Guidance")
-                            st.write("Debug Information:")
-                            st.write("- ElevenLabs Available:", ELEVENLABS_AVAILABLE)
-                            st.write("- API Key Set:", bool(os.getenv("ELEVENLABS_API_KEY")))
-                            
-                            if ELEVENLABS_AVAILABLE:
-                                with st.spinner("Generating voice guidance..."):
-                                    summary = create_voice_summary(recycling_advice)
-                                    if summary:
-                                        st.write("- Summary created successfully")
-                                        st.write("Summary text:", summary)
-                                        audio = generate_voice_guidance(summary)
-                                        if audio:
-                                            st.audio(audio, format='audio/mp3')
-                                        else:
-                                            st.error("Failed to generate audio")
-                                    else:
-                                        st.error("Failed to create summary")
-                            else:
-                                st.error("Voice guidance is currently disabled. ElevenLabs package not available.")
-
-                with result_tab3:
-                    # Get environmental metrics
-                    metrics = get_environmental_metrics(items)
-                    
-                    if metrics:
-                        # Create columns for the visualizations
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            # Carbon Footprint Breakdown
-                            st.markdown("""
-                                <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow); margin-bottom: 1rem;'>
-                                    <h4 style='color: var(--primary-green);'>🏭 Carbon Footprint Breakdown</h4>
-                            """, unsafe_allow_html=True)
-                            
-                            # Create a pie chart for carbon footprint
-                            import plotly.express as px
-                            carbon_data = metrics['carbon_footprint']
-                            fig = px.pie(
-                                values=list(carbon_data.values()),
-                                names=list(carbon_data.keys()),
-                                title='CO₂ Emissions by Stage (kg)',
-                                color_discrete_sequence=px.colors.sequential.Greens
-                            )
-                            st.plotly_chart(fig, use_container_width=True)
-                            st.markdown("</div>", unsafe_allow_html=True)
-                            
-                            # Water Usage Comparison
-                            st.markdown("""
-                                <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
-                                    <h4 style='color: var(--primary-green);'>💧 Water Usage Impact</h4>
-                            """, unsafe_allow_html=True)
-                            
-                            water_data = metrics['water_usage']
-                            fig = px.bar(
-                                x=list(water_data.keys()),
-                                y=list(water_data.values()),
-                                title='Water Consumption (Liters)',
-                                color_discrete_sequence=px.colors.sequential.Blues
-                            )
-                            st.plotly_chart(fig, use_container_width=True)
-                            st.markdown("</div>", unsafe_allow_html=True)
-                        
-                        with col2:
-                            # Energy Savings
-                            st.markdown("""
-                                <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow); margin-bottom: 1rem;'>
-                                    <h4 style='color: var(--primary-green);'>⚡ Energy Impact</h4>
-                            """, unsafe_allow_html=True)
-                            
-                            energy_savings = metrics['energy_savings']['recycling_vs_new']
-                            percentage_saved = metrics['energy_savings']['percentage_saved']
-                            
-                            import plotly.graph_objects as go
-                            fig = go.Figure(go.Indicator(
-                                mode = "gauge+number",
-                                value = percentage_saved,
-                                title = {'text': "Energy Savings vs. New Production"},
-                                gauge = {
-                                    'axis': {'range': [0, 100]},
-                                    'bar': {'color': "#2E7D32"},
-                                    'steps': [
-                                        {'range': [0, 33], 'color': "#E8F5E9"},
-                                        {'range': [33, 66], 'color': "#A5D6A7"},
-                                        {'range': [66, 100], 'color': "#4CAF50"}
-                                    ]
-                                }
-                            ))
-                            st.plotly_chart(fig, use_container_width=True)
-                            st.markdown("</div>", unsafe_allow_html=True)
-                            
-                            # Recycling Benefits
-                            st.markdown("""
-                                <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
-                                    <h4 style='color: var(--primary-green);'>🌱 Environmental Benefits</h4>
-                            """, unsafe_allow_html=True)
-                            
-                            benefits = metrics['recycling_benefits']
-                            fig = px.bar(
-                                x=list(benefits.keys()),
-                                y=list(benefits.values()),
-                                title='Positive Environmental Impact',
-                                color_discrete_sequence=px.colors.sequential.Greens
-                            )
-                            fig.update_layout(showlegend=False)
-                            st.plotly_chart(fig, use_container_width=True)
-                            st.markdown("</div>", unsafe_allow_html=True)
-                        
-                        # Additional metrics display
-                        st.markdown("""
-                            <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow); margin-top: 1rem;'>
-                                <h4 style='color: var(--primary-green);'>📊 Additional Impact Metrics</h4>
-                                <div style='display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 1rem; margin-top: 1rem;'>
-                        """, unsafe_allow_html=True)
-                        
-                        # Display landfill impact
-                        landfill = metrics['landfill_impact']
-                        st.markdown(f"""
-                            <div style='background: #F1F8E9; padding: 1rem; border-radius: 8px;'>
-                                <h5 style='color: #2E7D32; margin-bottom: 0.5rem;'>Landfill Impact</h5>
-                                <p>Volume: {landfill['volume']:.2f} m³</p>
-                                <p>Decomposition: {landfill['decomposition_time']:.1f} years</p>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        
-                        st.markdown("</div></div>", unsafe_allow_html=True)
-                    
-                    # Environmental impact text analysis
-                    impact_prompt = f"""Analyze the environmental impact of recycling these items: {', '.join(items)}
-                    
-                    Please provide a clear, engaging analysis covering:
-                    1. Immediate material impact (with specific metrics where possible)
-                    2. Energy and water savings
-                    3. Pollution reduction benefits
-                    4. Long-term environmental benefits
-                    
-                    Format the response in clear, readable paragraphs with bullet points for key metrics.
-                    Use an encouraging, positive tone."""
-                    
-                    model = init_gemini()
-                    if model:
-                        impact_response = model.generate_content(impact_prompt)
-                        impact_response.resolve()
-                        environmental_impact = impact_response.text.strip()
-                        
-                        st.markdown("""
-                            <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
-                                <h3 style='color: var(--primary-green);'>🌍 Environmental Impact Analysis</h3>
-                                {}
-                            </div>
-                        """.format(environmental_impact), unsafe_allow_html=True)
-                        
-                        # Chat interface section
-                        st.markdown("<h3>💬 Chat with EcoBot</h3>", unsafe_allow_html=True)
-                        
-                        if 'messages' not in st.session_state:
-                            st.session_state.messages = []
-
-                        if st.button("Clear Chat History", key="clear_chat"):
-                            st.session_state.messages = []
-                            st.session_state.thinking = False
-                            st.rerun()
-
-                        for message in st.session_state.messages:
-                            display_chat_message(message['text'], message['is_user'])
-                        
-                        if 'thinking' not in st.session_state:
-                            st.session_state.thinking = False
-
-                        user_message = st.chat_input(
-                            "Ask about recycling and sustainability",
-                            key="chat_input",
-                            disabled=st.session_state.thinking
-                        )
-                        
-                        if user_message:
-                            if not st.session_state.thinking:
-                                st.session_state.thinking = True
-                                st.session_state.messages.append({"text": user_message, "is_user": True})
-                                
-                                with st.spinner("EcoBot is thinking..."):
-                                    context = "\n".join([
-                                        f"{'User' if m['is_user'] else 'EcoBot'}: {m['text']}" 
-                                        for m in st.session_state.messages[-4:-1]
-                                    ] if len(st.session_state.messages) > 1 else [])
-                                    
-                                    bot_response = get_chatbot_response(
-                                        user_message,
-                                        context=context,
-                                        items=items,
-                                        recycling_advice=recycling_advice,
-                                        environmental_impact=environmental_impact
-                                    )
-                                
-                                st.session_state.messages.append({"text": bot_response, "is_user": False})
-                                st.session_state.thinking = False
-                                st.rerun()
+                render_diagnostics()
             else:
+                api_key = os.getenv("GOOGLE_API_KEY")
+                if api_key and not check_gemini_health(api_key):
+                    st.warning("The Gemini API is not reachable right now. Please try again in a moment.")
                 st.markdown("""
                     <div style='background: white; padding: 1.5rem; border-radius: 10px; box-shadow: var(--shadow);'>
                         <h3 style='color: var(--primary-green);'>🌍 Environmental Impact Analysis</h3>
@@ -1,19 +1,31 @@
 from fastapi import FastAPI, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import google.generativeai as genai
-from PyPDF2 import PdfReader
-import pdfplumber
+from fastapi.responses import JSONResponse, PlainTextResponse
 import os
 from dotenv import load_dotenv
+import asyncio
 import json
+import sys
 from mangum import Mangum
 
+# Shared modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from call_gateway import CircuitOpenError, gateway_stats
+from ecoscan_pipeline import check_gemini_health, generate_text_async, init_gemini
+from scan_api import router as scan_router
+from lecture_flowchart import check_flowchart, merge_flowcharts, split_sections
+from pdf_extraction import extract_text
+from telemetry import observe, prometheus_text, record, span
+
 # Load environment variables
 load_dotenv()
 
-# Initialize Gemini AI
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# Longer text is split into section-aware chunks that are charted concurrently and merged
+FLOWCHART_CHUNK_CHARS = int(os.getenv("FLOWCHART_CHUNK_CHARS", "48000"))
+# Chunk requests in flight per upload; the gateway bounds Gemini calls across uploads
+FLOWCHART_CONCURRENCY = int(os.getenv("FLOWCHART_CONCURRENCY", "8"))
+# Most nodes in any returned flowchart; a single prompt asks for at most 15
+FLOWCHART_MAX_NODES = int(os.getenv("FLOWCHART_MAX_NODES", "40"))
 
 app = FastAPI(title="LectureFlowViz API")
 handler = Mangum(app)
@@ -27,29 +39,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def extract_text_from_pdf(pdf_file):
-    """Extract text from PDF using both PyPDF2 and pdfplumber for better accuracy"""
-    text = ""
-    
-    # First try with PyPDF2
-    pdf = PdfReader(pdf_file)
-    for page in pdf.pages:
-        text += page.extract_text() + "\n"
-    
-    # If PyPDF2 didn't extract much text, try pdfplumber
-    if len(text.strip()) < 100:
-        with pdfplumber.open(pdf_file) as pdf:
-            text = ""
-            for page in pdf.pages:
-                text += page.extract_text() + "\n"
+# EcoScan image scanning and chat endpoints
+app.include_router(scan_router)
+
+def pdf_upload_buffer(file):
+    """Return the upload's own seekable buffer, rewound, and its size
     
-    return text.strip()
+    Starlette has already spooled the upload (in memory, rolling over to an
+    unnamed file in the system temp directory), so it is parsed in place:
+    nothing is copied or written to the working directory, and concurrent
+    uploads of the same name can't collide.
+    """
+    buffer = file.file
+    size = buffer.seek(0, os.SEEK_END)
+    buffer.seek(0)
+    return buffer, size
 
-def generate_flowchart(text):
-    """Generate flowchart structure using Gemini AI"""
-    model = genai.GenerativeModel('gemini-1.0-pro')
+def extract_text_from_pdf(pdf_file):
+    """Extract text from PDF, using pdfplumber only for pages PyPDF2 reads poorly
     
-    prompt = f"""Analyze this lecture text and create a flowchart structure. 
+    pdf_file can be a path or a seekable binary file. Returns the text and
+    one timing per page (extractor used, characters, milliseconds).
+    """
+    text, pages = extract_text(pdf_file)
+    for page in pages:
+        observe(f"pdf_page_{page['extractor']}", page["ms"] / 1000)
+    return text.strip(), pages
+
+def flowchart_prompt(text, max_nodes):
+    return f"""Analyze this lecture text and create a flowchart structure. 
     Return the result as a JSON object with the following structure:
     {{
         "nodes": [
@@ -68,16 +86,55 @@ def generate_flowchart(text):
     2. Maintain logical flow and hierarchy
     3. Keep node text concise (max 50 characters)
     4. Create meaningful connections between related concepts
-    5. Maximum 15 nodes for clarity
+    5. Maximum {max_nodes} nodes for clarity
     
     Text to analyze:
     {text}
     """
+
+async def request_flowchart(prompt):
+    """Send one flowchart prompt through the gateway and parse the JSON reply"""
+    # The first call imports the Gemini SDK, so keep it off the event loop
+    model = await asyncio.to_thread(init_gemini, "flowchart")
+    if not model:
+        raise RuntimeError("Gemini is not configured")
+    # Identical uploads being processed at the same time share one request
+    return json.loads(await generate_text_async(model, prompt))
+
+async def generate_chunked_flowchart(text):
+    """Chart each section-aware chunk concurrently and merge the results
+    
+    Chunks that fail, or whose reply isn't a node/edge object, are left out of
+    the merged flowchart; the request only fails when every chunk does.
+    """
+    chunks = split_sections(text, FLOWCHART_CHUNK_CHARS)
+    # Share the node budget between chunks; merging removes duplicates
+    nodes_per_chunk = max(3, min(15, -(-FLOWCHART_MAX_NODES // len(chunks))))
+    limit = asyncio.Semaphore(FLOWCHART_CONCURRENCY)
+    
+    async def chart(chunk):
+        async with limit:
+            with span("flowchart_chunk"):
+                return check_flowchart(await request_flowchart(flowchart_prompt(chunk, nodes_per_chunk)))
     
+    results = await asyncio.gather(*(chart(chunk) for chunk in chunks), return_exceptions=True)
+    charts = [result for result in results if not isinstance(result, BaseException)]
+    if not charts:
+        raise results[0]
+    return merge_flowcharts(charts, FLOWCHART_MAX_NODES)
+
+async def generate_flowchart(text):
+    """Generate flowchart structure using Gemini AI"""
     try:
-        response = model.generate_content(prompt)
-        response.resolve()
-        return json.loads(response.text)
+        with span("flowchart"):
+            if len(text) > FLOWCHART_CHUNK_CHARS:
+                return await generate_chunked_flowchart(text)
+            flowchart = check_flowchart(await request_flowchart(flowchart_prompt(text, min(15, FLOWCHART_MAX_NODES))))
+        if len(flowchart["nodes"]) > FLOWCHART_MAX_NODES:
+            flowchart = merge_flowcharts([flowchart], FLOWCHART_MAX_NODES)
+        return flowchart
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"Error generating flowchart: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating flowchart: {str(e)}")
 
@@ -88,32 +145,39 @@ async def process_pdf(file: UploadFile):
         raise HTTPException(status_code=400, detail="Only PDF files are accepted")
     
     try:
-        # Read the PDF content
-        contents = await file.read()
-        
-        # Create a temporary file to handle the PDF
-        temp_path = f"temp_{file.filename}"
-        with open(temp_path, 'wb') as f:
-            f.write(contents)
+        buffer, size = pdf_upload_buffer(file)
         
-        # Extract text from PDF
-        text = extract_text_from_pdf(temp_path)
-        
-        # Clean up temporary file
-        os.remove(temp_path)
+        # Extract text from PDF in a worker thread so the event loop keeps serving requests;
+        # the upload is closed as soon as its text is out
+        with buffer, span("pdf_extraction"):
+            record(bytes_received=size)
+            text, _ = await asyncio.to_thread(extract_text_from_pdf, buffer)
         
         if not text:
             raise HTTPException(status_code=400, detail="Could not extract text from PDF")
         
         # Generate flowchart data
-        flowchart_data = generate_flowchart(text)
+        flowchart_data = await generate_flowchart(text)
         
         return JSONResponse(content=flowchart_data)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/metrics")
+async def metrics():
+    """Stage, gateway and coalescing metrics in the Prometheus text format"""
+    return PlainTextResponse(prometheus_text(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/health")
-async def health_check():
+async def health_check(deep: bool = False):
     """Health check endpoint"""
+    if deep:
+        return {
+            "status": "healthy",
+            "gemini": await asyncio.to_thread(check_gemini_health, os.getenv("GOOGLE_API_KEY")),
+            "gateway": gateway_stats(),
+        }
     return {"status": "healthy"} 
\ No newline at end of file
@@ -0,0 +1,252 @@
+"""Run the EcoScan pipeline over a directory or manifest of images.
+
+Each image goes through detection, recycling instructions and environmental
+metrics. Results are written as they finish to JSONL (one object per line)
+or Parquet (one part file per run), and finished paths are appended to a
+checkpoint file so an interrupted run can be resumed. Failed images are kept
+out of the results and listed, one row per path, in a failures file; they
+are retried on resume.
+
+Usage:
+    python batch_scan.py photos/ --output results.jsonl --workers 8
+    python batch_scan.py manifest.txt --output results.parquet
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import call_gateway
+from canonical_items import prompt_item_names
+from ecoscan_pipeline import detect_items, get_environmental_metrics, get_recycling_instructions
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+PARQUET_BATCH_ROWS = 100
+PROGRESS_EVERY = 25
+
+logger = logging.getLogger("batch_scan")
+
+
+def find_images(source):
+    """Image paths from a directory (recursively) or a manifest file"""
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+        return sorted(paths)
+
+    # Manifest: one path per line, or JSON lines with a "path" field
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            paths.append(path if os.path.isabs(path) else os.path.join(base, path))
+    return paths
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def load_failures(path):
+    """Failed rows from earlier runs, by image path"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return {row["path"]: row for row in rows}
+
+
+def save_failures(path, failures):
+    """Replace the failures file with the images that are still failing"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        for row in failures.values():
+            f.write(json.dumps(row) + "\n")
+    os.replace(temp_path, path)
+
+
+def scan_image(path, with_instructions=True, with_metrics=True):
+    """Run detection, instructions and metrics for one image and return a result row"""
+    start = time.perf_counter()
+    row = {"path": path, "status": "failed", "items": [], "instructions": None, "metrics": None}
+    try:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+
+        image_stats = {}
+        # Upstream errors raise here, so only a real empty result reads as "no items detected"
+        detections = detect_items(image_bytes, image_stats, raise_errors=True)
+        row["image_stats"] = {key: value for key, value in image_stats.items() if key.endswith(("_bytes", "_ms"))}
+        if detections:
+            items = [detection["name"] for detection in detections]
+            row["items"] = detections
+            if with_instructions:
+                row["instructions"] = get_recycling_instructions(", ".join(prompt_item_names(items)))
+            if with_metrics:
+                row["metrics"] = get_environmental_metrics(items)
+            # Both stages return None on upstream errors; such rows stay failed so a resume retries them
+            missing = [stage for stage, wanted in (("instructions", with_instructions), ("metrics", with_metrics))
+                       if wanted and row[stage] is None]
+            if missing:
+                row["error"] = f"no {' or '.join(missing)} returned"
+            else:
+                row["status"] = "ok"
+        else:
+            row["error"] = "no items detected"
+    except Exception as e:
+        row["error"] = str(e)
+    row["elapsed_s"] = round(time.perf_counter() - start, 3)
+    return row
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, row):
+        self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Writes rows in batches to a new part file inside the output directory"""
+
+    def __init__(self, directory):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow: pip install pyarrow")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"part-{datetime.now():%Y%m%d-%H%M%S}.parquet")
+        self.writer = None
+        self.rows = []
+
+    def write(self, row):
+        # Nested fields are stored as JSON strings to keep one flat schema
+        self.rows.append({key: json.dumps(value) if isinstance(value, (dict, list)) else value for key, value in row.items()})
+        if len(self.rows) >= PARQUET_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.rows:
+            return
+        columns = ["path", "status", "items", "instructions", "metrics", "image_stats", "elapsed_s", "error"]
+        table = pa.table({column: [row.get(column) for row in self.rows] for column in columns},
+                         schema=pa.schema([(column, pa.float64() if column == "elapsed_s" else pa.string()) for column in columns]))
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def wait_for_circuit(backend="gemini"):
+    """Hold back new work while the backend's circuit breaker is open"""
+    breaker = call_gateway.BACKENDS[backend].breaker
+    while breaker.state == "open":
+        time.sleep(1)
+
+
+def run_batch(paths, output, checkpoint, failures_path, workers, with_instructions=True, with_metrics=True):
+    done = load_checkpoint(checkpoint)
+    todo = [path for path in paths if path not in done]
+    failures = {path: row for path, row in load_failures(failures_path).items() if path not in done}
+    logger.info("%d images, %d already done, %d to scan", len(paths), len(paths) - len(todo), len(todo))
+
+    writer = ParquetWriter(output) if output.endswith(".parquet") else JsonlWriter(output)
+    checkpoint_file = open(checkpoint, "a", encoding="utf-8")
+    lock = threading.Lock()
+    counts = {"ok": 0, "failed": 0}
+    start = time.perf_counter()
+
+    def record(row):
+        with lock:
+            counts[row["status"]] += 1
+            # Only successful scans are written and checkpointed, so failures are
+            # retried on resume without adding a result row each time
+            if row["status"] == "ok":
+                writer.write(row)
+                checkpoint_file.write(row["path"] + "\n")
+                checkpoint_file.flush()
+                failures.pop(row["path"], None)
+            else:
+                failures[row["path"]] = row
+            finished = counts["ok"] + counts["failed"]
+            if finished % PROGRESS_EVERY == 0:
+                rate = finished / (time.perf_counter() - start) * 60
+                logger.info("%d/%d scanned, %.1f images/min", finished, len(todo), rate)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for path in todo:
+                # Keep at most two images per worker queued
+                while len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(future.result())
+                wait_for_circuit()
+                pending.add(executor.submit(scan_image, path, with_instructions, with_metrics))
+            for future in wait(pending).done:
+                record(future.result())
+    finally:
+        writer.close()
+        checkpoint_file.close()
+        save_failures(failures_path, failures)
+
+    elapsed = time.perf_counter() - start
+    finished = counts["ok"] + counts["failed"]
+    throughput = finished / elapsed * 60 if elapsed else 0.0
+    logger.info("Finished %d images (%d ok, %d failed) in %.1fs: %.1f images/min",
+                finished, counts["ok"], counts["failed"], elapsed, throughput)
+    return {**counts, "elapsed_s": elapsed, "images_per_min": throughput}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan a directory or manifest of images with the EcoScan pipeline")
+    parser.add_argument("source", help="directory of images, or a manifest with one path (or JSON object with \"path\") per line")
+    parser.add_argument("--output", default="results.jsonl", help="results.jsonl, or a *.parquet directory for Parquet part files")
+    parser.add_argument("--checkpoint", help="file listing finished images (default: <output>.checkpoint)")
+    parser.add_argument("--failures", help="JSONL file of images that failed (default: <output>.failures.jsonl)")
+    parser.add_argument("--workers", type=int, default=4, help="images scanned concurrently")
+    parser.add_argument("--no-instructions", action="store_true", help="skip the recycling instructions stage")
+    parser.add_argument("--no-metrics", action="store_true", help="skip the environmental metrics stage")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if not os.getenv("GOOGLE_API_KEY"):
+        parser.error("GOOGLE_API_KEY is not set")
+
+    paths = find_images(args.source)
+    checkpoint = args.checkpoint or args.output.rstrip("/") + ".checkpoint"
+    failures = args.failures or args.output.rstrip("/") + ".failures.jsonl"
+    summary = run_batch(paths, args.output, checkpoint, failures, args.workers,
+                        with_instructions=not args.no_instructions, with_metrics=not args.no_metrics)
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Import-time report for the Streamlit page and the API cold start.
+
+Runs each target in a fresh interpreter under `python -X importtime` and
+reports the total import time, the slowest direct imports and any
+deferred module (Gemini SDK, PDF parsers, Plotly, ElevenLabs, NumPy) that
+was imported at startup. Exits non-zero when a deferred module shows up or a
+target exceeds its --budget, so cold-start regressions are caught.
+
+Usage:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget api=800 --output imports.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code run for each target, the modules it must not import at startup, and
+# optional baseline code whose own imports are not held against the target
+TARGETS = {
+    "api": {
+        "code": "import api.main",
+        "deferred": ("google.generativeai", "PyPDF2", "pdfplumber", "plotly", "elevenlabs", "PIL", "numpy"),
+    },
+    "pipeline": {
+        "code": "import ecoscan_pipeline",
+        "deferred": ("google.generativeai", "pdfplumber", "plotly", "elevenlabs", "PIL", "numpy"),
+    },
+    # The page runs in Streamlit's bare mode, which executes the script without a server.
+    # Streamlit itself loads parts of plotly and PIL, so only what the page adds counts.
+    "streamlit": {
+        "code": "import runpy; runpy.run_path('ai_engine_V4.py', run_name='__main__')",
+        "deferred": ("google.generativeai", "pdfplumber", "plotly", "elevenlabs", "PIL"),
+        "baseline": "import streamlit",
+    },
+}
+
+
+def parse_importtime(stderr):
+    """(module, self_us, cumulative_us, depth) for every line of -X importtime output"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # header line
+        name = fields[2]
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        entries.append((stripped, int(fields[0]), int(fields[1]), depth))
+    return entries
+
+
+def measure(code, env):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "target failed")
+    return parse_importtime(result.stderr)
+
+
+def report(spec, env, top):
+    entries = measure(spec["code"], env)
+    imported = {entry[0] for entry in entries}
+    baseline = {entry[0] for entry in measure(spec["baseline"], env)} if "baseline" in spec else set()
+    added = imported - baseline
+    # Direct imports of the entry point are the useful level of detail
+    shallow = [entry for entry in entries if entry[3] <= 1]
+    return {
+        "total_ms": sum(entry[2] for entry in entries if entry[3] == 0) / 1000,
+        "modules": len(entries),
+        "modules_beyond_baseline": len(added) if baseline else None,
+        "slowest": [
+            {"module": name, "cumulative_ms": cumulative / 1000}
+            for name, _, cumulative, _ in sorted(shallow, key=lambda entry: -entry[2])[:top]
+        ],
+        "deferred_imported": sorted(
+            module for module in spec["deferred"]
+            if module in added or any(name.startswith(module + ".") for name in added)
+        ),
+    }
+
+
+def import_env():
+    """Environment for the target interpreters"""
+    # No keys are needed to import; keep the page from reaching real services
+    return {**os.environ, "GOOGLE_API_KEY": "", "ELEVENLABS_API_KEY": ""}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report import time for EcoScan entry points")
+    parser.add_argument("--target", choices=sorted(TARGETS), action="append", help="default: all targets")
+    parser.add_argument("--budget", action="append", default=[], metavar="TARGET=MS",
+                        help="fail when a target's total import time exceeds MS")
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to list")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    budgets = {}
+    for budget in args.budget:
+        target, _, ms = budget.partition("=")
+        budgets[target] = float(ms)
+
+    env = import_env()
+    results = {}
+    failed = False
+    for target in args.target or sorted(TARGETS):
+        try:
+            result = report(TARGETS[target], env, args.top)
+        except RuntimeError as e:
+            print(f"{target}: could not import ({e})")
+            failed = True
+            continue
+        results[target] = result
+
+        print(f"\n{target}: {result['total_ms']:.0f} ms across {result['modules']} modules")
+        for entry in result["slowest"]:
+            print(f"  {entry['cumulative_ms']:>8.1f} ms  {entry['module']}")
+        if result["deferred_imported"]:
+            print(f"  FAIL imported at startup: {', '.join(result['deferred_imported'])}")
+            failed = True
+        if target in budgets and result["total_ms"] > budgets[target]:
+            print(f"  FAIL over budget of {budgets[target]:.0f} ms")
+            failed = True
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,379 @@
+"""End-to-end latency benchmarks for EcoScan and the PDF flowchart API.
+
+Runs the same pipeline functions the Streamlit page uses for Simple and
+Advanced mode, plus process_pdf from api/main.py, against the stubs in
+benchmarks/stubs.py. Reports p50/p95/p99 per stage and end to end, and
+writes them as JSON so runs can be compared across commits.
+
+Usage:
+    python benchmarks/run_benchmarks.py --iterations 50 --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubs  # noqa: E402
+
+SCENARIOS = ("simple", "advanced", "pdf")
+PERCENTILES = (50, 95, 99)
+# Polling interval used to catch the first streamed chunk
+POLL_SECONDS = 0.005
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples):
+    """Stage name -> latency summary in milliseconds"""
+    summary = {}
+    for stage, values in samples.items():
+        ms = [value * 1000 for value in values]
+        summary[stage] = {
+            "n": len(ms),
+            "mean": sum(ms) / len(ms),
+            "min": min(ms),
+            "max": max(ms),
+            **{f"p{pct}": percentile(ms, pct) for pct in PERCENTILES},
+        }
+    return summary
+
+
+def make_image(seed):
+    """A distinct JPEG per iteration so no request is served from a cache"""
+    from PIL import Image
+
+    image = Image.new("RGB", (1200, 900), (seed * 37 % 256, seed * 91 % 256, 120))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def make_pdf(pages, lines_per_page=40):
+    """A minimal text-only PDF with Helvetica lines on every page"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(pages):
+        lines = [f"Lecture {page + 1} line {line + 1}: recycling keeps materials in use" for line in range(lines_per_page)]
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 760 Td {text} ET".encode("latin-1")
+        page_number = len(objects) + 1
+        kids.append(f"{page_number} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_number + 1} 0 R >>".encode("latin-1")
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode("latin-1")
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+class Benchmark:
+    def __init__(self, args, backend):
+        self.args = args
+        self.backend = backend
+        # Imported only after the stubs are installed
+        import ecoscan_pipeline
+        import canonical_items
+        self.pipeline = ecoscan_pipeline
+        self.prompt_item_names = canonical_items.prompt_item_names
+
+    def reset_caches(self):
+        """Start every iteration cold unless --warm is given"""
+        if self.args.warm:
+            return
+        shutil.rmtree(self.pipeline.TTS_CACHE_DIR, ignore_errors=True)
+        cache = self.pipeline.get_item_metrics_cache()
+        with cache["lock"]:
+            cache["vectors"].clear()
+        self.pipeline.build_scan_context.cache_clear()
+
+    def streamed(self, timings, stage, func, *args):
+        """Run a streaming stage, recording time to first chunk and to completion"""
+        partial = []
+        start = time.perf_counter()
+        future = self.pipeline.get_stage_executor().submit(func, *args, partial)
+        while not future.done():
+            if partial and f"{stage}_first_chunk" not in timings:
+                timings[f"{stage}_first_chunk"] = time.perf_counter() - start
+            time.sleep(POLL_SECONDS)
+        result = future.result()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    def voice(self, timings, advice):
+        """Same voice path as run_voice_stage in ai_engine_V4.py"""
+        pipeline = self.pipeline
+        start = time.perf_counter()
+        if pipeline.VOICE_PIPELINE and pipeline.init_elevenlabs():
+            clips = []
+            future = pipeline.get_stage_executor().submit(pipeline.pipeline_voice_guidance, advice, clips)
+            while not future.done():
+                if clips and "voice_first_clip" not in timings:
+                    timings["voice_first_clip"] = time.perf_counter() - start
+                time.sleep(POLL_SECONDS)
+            summary, audio = future.result()
+        else:
+            summary = pipeline.create_voice_summary(advice)
+            audio = pipeline.generate_voice_guidance(summary) if summary else None
+        timings["voice"] = time.perf_counter() - start
+        return audio
+
+    def detect(self, timings, image_bytes):
+        start = time.perf_counter()
+        detections = self.pipeline.detect_items(image_bytes, {})
+        timings["detection"] = time.perf_counter() - start
+        if not detections:
+            raise RuntimeError("detection returned no items")
+        return [detection["name"] for detection in detections]
+
+    def run_simple(self, seed):
+        timings = {}
+        start = time.perf_counter()
+        items = self.detect(timings, make_image(seed))
+        names = ", ".join(self.prompt_item_names(items))
+        instructions = self.streamed(timings, "instructions", self.pipeline.get_recycling_instructions, names)
+        self.voice(timings, instructions)
+        timings["end_to_end"] = time.perf_counter() - start
+        return timings
+
+    def run_advanced(self, seed):
+        """Advanced mode, opening the Recycling Guide tab and then the Environmental Impact tab
+        
+        As in render_analysis_tabs, a tab's stages start only when it is opened.
+        """
+        timings = {}
+        start = time.perf_counter()
+        items = self.detect(timings, make_image(seed))
+        names = self.prompt_item_names(items)
+
+        # Recycling Guide: the voice summary is chained after the guide, as in start_guide_stages
+        tab_start = time.perf_counter()
+        instructions = self.streamed(timings, "instructions", self.pipeline.get_recycling_instructions, ", ".join(names))
+        self.voice(timings, instructions)
+        timings["guide_tab"] = time.perf_counter() - tab_start
+
+        def metrics():
+            metrics_start = time.perf_counter()
+            self.pipeline.get_environmental_metrics(items)
+            timings["metrics"] = time.perf_counter() - metrics_start
+
+        # Environmental Impact: metrics and the impact analysis start together, as in start_impact_stages
+        tab_start = time.perf_counter()
+        metrics_future = self.pipeline.get_stage_executor().submit(metrics)
+        self.streamed(timings, "impact", self.pipeline.get_environmental_impact, names)
+        metrics_future.result()
+        timings["impact_tab"] = time.perf_counter() - tab_start
+        timings["end_to_end"] = time.perf_counter() - start
+        return timings
+
+    def run_pdf(self, seed):
+        from starlette.datastructures import UploadFile
+
+        timings = {}
+        upload = UploadFile(file=io.BytesIO(self.pdf_bytes), filename=f"lecture-{seed}.pdf")
+        start = time.perf_counter()
+        asyncio.run(self.pdf_api.process_pdf(upload))
+        timings["end_to_end"] = time.perf_counter() - start
+        for stage, durations in self.pdf_stage_times.items():
+            if durations:
+                timings[stage] = durations.pop()
+        return timings
+
+    def setup_pdf(self):
+        from api import main as pdf_api
+
+        self.pdf_api = pdf_api
+        self.pdf_bytes = make_pdf(self.args.pdf_pages)
+        self.pdf_stage_times = {}
+
+        # Time the helpers process_pdf calls by wrapping the module attributes it looks up
+        for stage, name in (("extraction", "extract_text_from_pdf"), ("flowchart", "generate_flowchart")):
+            func = getattr(pdf_api, name, None)
+            if func is None:
+                continue
+            durations = self.pdf_stage_times[stage] = []
+
+            def timed(*args, _func=func, _durations=durations, **kwargs):
+                stage_start = time.perf_counter()
+                try:
+                    return _func(*args, **kwargs)
+                finally:
+                    _durations.append(time.perf_counter() - stage_start)
+
+            async def timed_async(*args, _func=func, _durations=durations, **kwargs):
+                stage_start = time.perf_counter()
+                try:
+                    return await _func(*args, **kwargs)
+                finally:
+                    _durations.append(time.perf_counter() - stage_start)
+
+            setattr(pdf_api, name, timed_async if asyncio.iscoroutinefunction(func) else timed)
+
+    def run(self, scenario):
+        runner = getattr(self, f"run_{scenario}")
+        if scenario == "pdf":
+            self.setup_pdf()
+
+        samples = {}
+        errors = 0
+        # Warm-up iterations are not recorded
+        for seed in range(self.args.warmup):
+            self.reset_caches()
+            runner(-1 - seed)
+
+        def session(seed):
+            self.reset_caches()
+            return runner(seed)
+
+        calls_before = dict(self.backend.calls)
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            futures = [executor.submit(session, seed) for seed in range(self.args.iterations)]
+            for future in futures:
+                try:
+                    timings = future.result()
+                except Exception as e:
+                    errors += 1
+                    print(f"  {scenario} iteration failed: {e}", file=sys.stderr)
+                    continue
+                for stage, value in timings.items():
+                    samples.setdefault(stage, []).append(value)
+        wall = time.perf_counter() - wall_start
+
+        return {
+            "stages": summarize(samples),
+            "errors": errors,
+            "wall_seconds": wall,
+            "upstream_calls": {name: self.backend.calls[name] - calls_before[name] for name in calls_before},
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    for scenario, result in results["scenarios"].items():
+        print(f"\n{scenario} ({result['errors']} errors, {result['wall_seconds']:.1f}s wall, calls {result['upstream_calls']})")
+        print(f"  {'stage':<26}{'p50':>10}{'p95':>10}{'p99':>10}")
+        base_stages = (baseline or {}).get("scenarios", {}).get(scenario, {}).get("stages", {})
+        for stage, stats in result["stages"].items():
+            line = f"  {stage:<26}" + "".join(f"{stats[f'p{pct}']:>8.0f}ms" for pct in PERCENTILES)
+            if stage in base_stages:
+                changes = []
+                for pct in PERCENTILES:
+                    before = base_stages[stage][f"p{pct}"]
+                    changes.append(f"{(stats[f'p{pct}'] - before) / before * 100:+.0f}%" if before else "n/a")
+                line += "   vs baseline " + " / ".join(changes)
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latency benchmarks against stub Gemini/ElevenLabs backends")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1, help="unrecorded iterations run first")
+    parser.add_argument("--concurrency", type=int, default=1, help="sessions run in parallel")
+    parser.add_argument("--gemini-latency", default="lognormal:800,0.35",
+                        help="Gemini latency in ms: fixed:MS, uniform:LOW,HIGH, normal:MEAN,SD or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--tts-latency", default="lognormal:400,0.3", help="ElevenLabs latency, same format")
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--warm", action="store_true", help="keep TTS and metrics caches between iterations")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="lift the gateway rate limits so only stub latency is measured")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    backend = stubs.StubBackend(args.gemini_latency, args.tts_latency, args.seed)
+    tts_url = stubs.install(backend)
+
+    # Point the app at the stubs before it reads its settings
+    cache_dir = tempfile.mkdtemp(prefix="ecoscan-bench-")
+    os.environ.update({
+        "GOOGLE_API_KEY": "stub",
+        "ELEVENLABS_API_KEY": "stub",
+        "ELEVENLABS_API_URL": tts_url,
+        "ECOSCAN_TTS_CACHE_DIR": os.path.join(cache_dir, "tts"),
+    })
+    os.environ.pop("ECOSCAN_SINGLE_FLIGHT_DIR", None)
+    if args.no_rate_limit:
+        for backend_name in ("GEMINI", "ELEVENLABS"):
+            os.environ[f"ECOSCAN_{backend_name}_RPS"] = "1000"
+            os.environ[f"ECOSCAN_{backend_name}_BURST"] = "1000"
+
+    benchmark = Benchmark(args, backend)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "scenarios": {},
+    }
+    try:
+        for scenario in scenarios:
+            print(f"Running {scenario} ({args.iterations} iterations, concurrency {args.concurrency})...", file=sys.stderr)
+            results["scenarios"][scenario] = benchmark.run(scenario)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 1 if any(result["errors"] for result in results["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
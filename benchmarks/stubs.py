@@ -0,0 +1,222 @@
+"""Stand-ins for Gemini and ElevenLabs used by the latency benchmarks.
+
+install() puts fake `google.generativeai` and `elevenlabs` modules in
+sys.modules and starts a local HTTP server for the ElevenLabs streaming
+endpoint, so the real pipeline code runs unchanged against canned
+responses with configurable latency.
+"""
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DETECTION_RESPONSE = {
+    "items": [
+        {"name": "plastic water bottle", "material": "plastic", "confidence": 0.93, "disposal_category": "recycling"},
+        {"name": "aluminum can", "material": "aluminum", "confidence": 0.88, "disposal_category": "recycling"},
+        {"name": "pizza box", "material": "paper", "confidence": 0.71, "disposal_category": "compost"},
+    ]
+}
+
+METRICS_RESPONSE = {
+    "carbon_footprint": {"manufacturing": 0.08, "transportation": 0.01, "disposal": 0.02},
+    "water_usage": {"manufacturing": 3.2, "recycling": 0.9},
+    "energy_savings": {"recycling_vs_new": 0.3, "percentage_saved": 72},
+    "landfill_impact": {"volume": 0.0004, "decomposition_time": 450},
+    "recycling_benefits": {"trees_saved": 0.0, "water_saved": 2.3, "energy_saved": 0.3},
+}
+
+FLOWCHART_RESPONSE = {
+    "nodes": [
+        {"id": "1", "text": "Lecture topic", "level": 1},
+        {"id": "2", "text": "First concept", "level": 2},
+        {"id": "3", "text": "Second concept", "level": 2},
+    ],
+    "edges": [{"from": "1", "to": "2"}, {"from": "1", "to": "3"}],
+}
+
+TEXT_RESPONSE = (
+    "Hey there, eco-warrior! Rinse the bottle and the can before recycling them. "
+    "Flatten the pizza box and tear off any greasy parts for the compost. "
+    "Put the bottle and can in the curbside recycling bin. "
+    "Recycling one aluminum can saves enough energy to run a TV for three hours! "
+    "Keep it up, you're making a real difference!"
+)
+
+# Number of chunks a streamed text response is split into
+STREAM_CHUNKS = 8
+
+
+class Latency:
+    """Latency distribution parsed from a spec such as "lognormal:800,0.4"
+
+    Supported specs (milliseconds): fixed:MS, uniform:LOW,HIGH,
+    normal:MEAN,STDDEV and lognormal:MEDIAN,SIGMA.
+    """
+
+    def __init__(self, spec, rng=None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",") if value]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        """One latency in seconds"""
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = self.rng.uniform(*self.params[:2])
+        elif self.kind == "normal":
+            ms = self.rng.gauss(*self.params[:2])
+        else:
+            median, sigma = self.params[:2]
+            ms = median * self.rng.lognormvariate(0, sigma)
+        return max(ms, 0.0) / 1000
+
+
+class StubBackend:
+    """Latency settings and call counters shared by the fake modules"""
+
+    def __init__(self, gemini_latency, tts_latency, seed=None):
+        rng = random.Random(seed)
+        self.gemini = Latency(gemini_latency, rng)
+        self.tts = Latency(tts_latency, rng)
+        self.calls = {"gemini": 0, "tts": 0}
+        self.lock = threading.Lock()
+
+    def count(self, backend):
+        with self.lock:
+            self.calls[backend] += 1
+
+
+class Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class Response:
+    """Mimics GenerateContentResponse for both plain and streamed calls"""
+
+    def __init__(self, contents, text, delays=None):
+        self.text = text
+        self.delays = delays
+        prompt = " ".join(part for part in (contents if isinstance(contents, list) else [contents]) if isinstance(part, str))
+        self.usage_metadata = types.SimpleNamespace(
+            prompt_token_count=(len(prompt) + 3) // 4,
+            candidates_token_count=(len(text) + 3) // 4,
+        )
+
+    def resolve(self):
+        pass
+
+    def __iter__(self):
+        words = self.text.split(" ")
+        size = max(1, len(words) // STREAM_CHUNKS)
+        for index, start in enumerate(range(0, len(words), size)):
+            time.sleep(self.delays[min(index, len(self.delays) - 1)])
+            end = start + size
+            yield Chunk(" ".join(words[start:end]) + (" " if end < len(words) else ""))
+
+
+def canned_response(contents, generation_config):
+    """Pick the canned answer for a request from its prompt and config"""
+    if isinstance(contents, list):
+        return json.dumps(DETECTION_RESPONSE)
+    prompt = str(contents)
+    if "flowchart" in prompt:
+        return json.dumps(FLOWCHART_RESPONSE)
+    if "carbon_footprint" in prompt:
+        return json.dumps(METRICS_RESPONSE)
+    return TEXT_RESPONSE
+
+
+def fake_genai(backend):
+    """A module with the parts of google.generativeai the app uses"""
+    module = types.ModuleType("google.generativeai")
+
+    class GenerativeModel:
+        def __init__(self, model_name="gemini-1.5-flash", generation_config=None, **kwargs):
+            self.model_name = model_name
+            self._generation_config = generation_config or {}
+
+        def generate_content(self, contents, stream=False, generation_config=None, request_options=None, **kwargs):
+            backend.count("gemini")
+            text = canned_response(contents, generation_config)
+            latency = backend.gemini.sample()
+            if stream:
+                # A third of the latency before the first chunk, the rest spread over the stream
+                first = latency * 0.3
+                rest = (latency - first) / STREAM_CHUNKS
+                return Response(contents, text, [first] + [rest] * STREAM_CHUNKS)
+            time.sleep(latency)
+            return Response(contents, text)
+
+        async def generate_content_async(self, contents, generation_config=None, request_options=None, **kwargs):
+            backend.count("gemini")
+            await asyncio.sleep(backend.gemini.sample())
+            return Response(contents, canned_response(contents, generation_config))
+
+    module.GenerativeModel = GenerativeModel
+    module.configure = lambda **kwargs: None
+    module.get_model = lambda name: types.SimpleNamespace(name=name)
+    return module
+
+
+def fake_elevenlabs(backend):
+    """A module with the parts of the legacy elevenlabs SDK the app uses"""
+    module = types.ModuleType("elevenlabs")
+
+    def generate(text, voice=None, model=None):
+        backend.count("tts")
+        time.sleep(backend.tts.sample())
+        return b"ID3" + text.encode("utf-8")
+
+    module.generate = generate
+    module.Voice = type("Voice", (), {})
+    module.set_api_key = lambda api_key: None
+    return module
+
+
+def start_tts_server(backend):
+    """Serve the ElevenLabs streaming endpoint locally; returns the base URL"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            backend.count("tts")
+            time.sleep(backend.tts.sample())
+            audio = b"ID3" + body.get("text", "").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(len(audio)))
+            self.end_headers()
+            self.wfile.write(audio)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def install(backend):
+    """Swap in the fake SDKs; must run before the app modules are imported"""
+    try:
+        import google
+    except ImportError:
+        google = sys.modules["google"] = types.ModuleType("google")
+    genai = fake_genai(backend)
+    sys.modules["google.generativeai"] = genai
+    google.generativeai = genai
+    sys.modules["elevenlabs"] = fake_elevenlabs(backend)
+    return start_tts_server(backend)
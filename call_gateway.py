@@ -0,0 +1,293 @@
+"""Shared gateway for upstream API calls (Gemini, ElevenLabs).
+
+Every call goes through a per-backend token-bucket rate limiter and a
+concurrency cap, is retried with jittered exponential backoff on 429/5xx
+and connection errors, and is short-circuited by a circuit breaker after
+repeated failures so sessions fail fast instead of piling onto an API that
+is already refusing requests. acall() applies the same limits to async
+SDK methods without blocking the event loop.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+
+# HTTP statuses worth retrying
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised when a backend's circuit breaker is rejecting calls"""
+
+
+class TokenBucket:
+    """Token-bucket rate limiter; acquire() blocks until a token is free"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take one token if one is free, otherwise return the seconds until the next one"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Take one token and return how long the caller waited for it"""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self):
+        """Like acquire(), but sleeps on the event loop instead of blocking it"""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one trial call through after a cool-down"""
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """Free the trial slot of a call that ended without an outcome, e.g. by cancellation"""
+        with self.lock:
+            self.trial_running = False
+
+
+class Backend:
+    """Rate limit, concurrency cap, retry policy and breaker for one upstream API"""
+
+    def __init__(self, name, rate, burst, max_concurrency, max_retries=3,
+                 base_delay=0.5, max_delay=8.0, failure_threshold=5, reset_seconds=30.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "rejected": 0,
+            "in_flight": 0,
+            "throttled_seconds": 0.0,
+        }
+        self.lock = threading.Lock()
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def admit(self):
+        """Count a call and raise CircuitOpenError if the breaker rejects it"""
+        self.count("calls")
+        if not self.breaker.allow():
+            self.count("rejected")
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable")
+
+    def retry_delay(self, error, attempt):
+        """Record a failed attempt and return the backoff before the next one, or None to give up"""
+        if not is_retryable(error):
+            # The backend answered, so this does not count against its health
+            self.breaker.record_success()
+            self.count("failures")
+            return None
+        if attempt >= self.max_retries:
+            self.breaker.record_failure()
+            self.count("failures")
+            return None
+
+        # Full jitter: sleep a random time up to the exponential cap
+        self.count("retries")
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt + 1)))
+
+    def call(self, func, *args, **kwargs):
+        """Run func through the backend's limits; raises CircuitOpenError if the circuit is open"""
+        self.admit()
+        settled = False
+        try:
+            attempt = 0
+            while True:
+                self.count("throttled_seconds", self.bucket.acquire())
+                with self.slots:
+                    self.count("in_flight")
+                    try:
+                        result = func(*args, **kwargs)
+                    except Exception as e:
+                        error = e
+                    else:
+                        settled = True
+                        self.breaker.record_success()
+                        self.count("successes")
+                        return result
+                    finally:
+                        self.count("in_flight", -1)
+
+                delay = self.retry_delay(error, attempt)
+                if delay is None:
+                    settled = True
+                    raise error
+                time.sleep(delay)
+                attempt += 1
+        finally:
+            # Interrupted before recording an outcome; a trial call must not hold the breaker half-open
+            if not settled:
+                self.breaker.abandon()
+
+    async def acall(self, func, *args, **kwargs):
+        """Async call(): await the coroutine function func under the same limits and breaker"""
+        self.admit()
+        settled = False
+        try:
+            attempt = 0
+            while True:
+                self.count("throttled_seconds", await self.bucket.acquire_async())
+                # The concurrency cap is shared with threaded callers, so poll it without blocking the loop
+                while not self.slots.acquire(blocking=False):
+                    await asyncio.sleep(0.01)
+                self.count("in_flight")
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                else:
+                    settled = True
+                    self.breaker.record_success()
+                    self.count("successes")
+                    return result
+                finally:
+                    self.count("in_flight", -1)
+                    self.slots.release()
+
+                delay = self.retry_delay(error, attempt)
+                if delay is None:
+                    settled = True
+                    raise error
+                await asyncio.sleep(delay)
+                attempt += 1
+        finally:
+            # Cancelled before recording an outcome; a trial call must not hold the breaker half-open
+            if not settled:
+                self.breaker.abandon()
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["circuit"] = self.breaker.state
+        return stats
+
+
+def error_status(error):
+    """HTTP status of an SDK or requests error, if it has one"""
+    for status in (getattr(error, "code", None), getattr(error, "status_code", None),
+                   getattr(getattr(error, "response", None), "status_code", None)):
+        try:
+            return int(status)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in ("DeadlineExceeded", "ServiceUnavailable", "ResourceExhausted",
+                                "InternalServerError", "ConnectionError", "Timeout", "ReadTimeout"):
+        return True
+    return error_status(error) in RETRYABLE_STATUSES
+
+
+BACKENDS = {
+    "gemini": Backend(
+        "gemini",
+        rate=float(os.getenv("ECOSCAN_GEMINI_RPS", "5")),
+        burst=int(os.getenv("ECOSCAN_GEMINI_BURST", "10")),
+        max_concurrency=int(os.getenv("ECOSCAN_GEMINI_CONCURRENCY", "8")),
+    ),
+    "elevenlabs": Backend(
+        "elevenlabs",
+        # Voice guidance sends one short request per sentence, about six per summary
+        rate=float(os.getenv("ECOSCAN_ELEVENLABS_RPS", "10")),
+        burst=int(os.getenv("ECOSCAN_ELEVENLABS_BURST", "20")),
+        max_concurrency=int(os.getenv("ECOSCAN_ELEVENLABS_CONCURRENCY", "4")),
+    ),
+}
+
+# Per-request timeout passed to the upstream SDKs, in seconds
+REQUEST_TIMEOUT = float(os.getenv("ECOSCAN_REQUEST_TIMEOUT", "60"))
+
+
+def call(backend, func, *args, **kwargs):
+    """Call func(*args, **kwargs) through the named backend's gateway"""
+    return BACKENDS[backend].call(func, *args, **kwargs)
+
+
+async def acall(backend, func, *args, **kwargs):
+    """Await func(*args, **kwargs) through the named backend's gateway"""
+    return await BACKENDS[backend].acall(func, *args, **kwargs)
+
+
+def gateway_stats():
+    """Per-backend counters and circuit state"""
+    return {name: backend.snapshot() for name, backend in BACKENDS.items()}
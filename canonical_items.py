@@ -0,0 +1,294 @@
+"""Map free-text item names from Gemini onto canonical item IDs.
+
+Detected names like "Plastic Water Bottle (empty)" or "PET bottle" are
+normalized and matched against a small synonym catalog, first exactly and
+then through a trigram index restricted to synonyms with the same head noun,
+so caches see one stable ID per kind of item.
+"""
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+# Canonical items with their material and known synonyms
+CATALOG = {
+    "plastic_bottle": {
+        "name": "plastic bottle",
+        "material": "plastic",
+        "synonyms": ["plastic water bottle", "pet bottle", "water bottle", "soda bottle", "plastic drink bottle", "pop bottle"],
+    },
+    "plastic_bag": {
+        "name": "plastic bag",
+        "material": "plastic",
+        "synonyms": ["shopping bag", "grocery bag", "carrier bag", "plastic carrier bag", "poly bag"],
+    },
+    "plastic_container": {
+        "name": "plastic container",
+        "material": "plastic",
+        "synonyms": ["plastic tub", "food container", "takeout container", "yogurt cup", "plastic clamshell"],
+    },
+    "plastic_cup": {
+        "name": "plastic cup",
+        "material": "plastic",
+        "synonyms": ["disposable cup", "plastic drinking cup"],
+    },
+    "plastic_straw": {
+        "name": "plastic straw",
+        "material": "plastic",
+        "synonyms": ["drinking straw", "straw"],
+    },
+    "plastic_cutlery": {
+        "name": "plastic cutlery",
+        "material": "plastic",
+        "synonyms": ["plastic fork", "plastic spoon", "plastic knife", "disposable cutlery"],
+    },
+    "bottle_cap": {
+        "name": "bottle cap",
+        "material": "plastic",
+        "synonyms": ["plastic cap", "plastic lid", "bottle lid", "screw cap"],
+    },
+    "styrofoam": {
+        "name": "styrofoam",
+        "material": "polystyrene",
+        "synonyms": ["polystyrene foam", "foam container", "foam cup", "expanded polystyrene", "eps foam"],
+    },
+    "aluminum_can": {
+        "name": "aluminum can",
+        "material": "aluminum",
+        "synonyms": ["aluminium can", "soda can", "beer can", "drink can", "beverage can", "pop can"],
+    },
+    "aluminum_foil": {
+        "name": "aluminum foil",
+        "material": "aluminum",
+        "synonyms": ["aluminium foil", "tin foil", "foil tray", "foil wrap"],
+    },
+    "steel_can": {
+        "name": "steel can",
+        "material": "steel",
+        "synonyms": ["tin can", "food can", "metal can", "canned food can"],
+    },
+    "aerosol_can": {
+        "name": "aerosol can",
+        "material": "metal",
+        "synonyms": ["spray can", "deodorant can"],
+    },
+    "glass_bottle": {
+        "name": "glass bottle",
+        "material": "glass",
+        "synonyms": ["wine bottle", "beer bottle", "glass drink bottle"],
+    },
+    "glass_jar": {
+        "name": "glass jar",
+        "material": "glass",
+        "synonyms": ["jam jar", "mason jar", "food jar"],
+    },
+    "cardboard_box": {
+        "name": "cardboard box",
+        "material": "paper",
+        "synonyms": ["cardboard", "corrugated cardboard", "shipping box", "carton box", "paperboard box", "cereal box"],
+    },
+    "paper": {
+        "name": "paper",
+        "material": "paper",
+        "synonyms": ["office paper", "printer paper", "sheet of paper", "notebook paper", "newspaper", "magazine", "junk mail"],
+    },
+    "paper_bag": {
+        "name": "paper bag",
+        "material": "paper",
+        "synonyms": ["brown paper bag", "kraft paper bag"],
+    },
+    "paper_cup": {
+        "name": "paper cup",
+        "material": "paper",
+        "synonyms": ["coffee cup", "disposable coffee cup", "takeaway cup"],
+    },
+    "pizza_box": {
+        "name": "pizza box",
+        "material": "paper",
+        "synonyms": ["greasy pizza box"],
+    },
+    "beverage_carton": {
+        "name": "beverage carton",
+        "material": "composite",
+        "synonyms": ["milk carton", "juice carton", "tetra pak", "drink carton"],
+    },
+    "battery": {
+        "name": "battery",
+        "material": "hazardous",
+        "synonyms": ["aa battery", "aaa battery", "alkaline battery", "lithium battery", "button cell"],
+    },
+    "mobile_phone": {
+        "name": "mobile phone",
+        "material": "electronics",
+        "synonyms": ["cell phone", "smartphone", "phone", "cellphone"],
+    },
+    "electronic_device": {
+        "name": "electronic device",
+        "material": "electronics",
+        "synonyms": ["electronics", "laptop", "tablet", "charger", "cable", "headphones", "keyboard", "computer mouse"],
+    },
+    "light_bulb": {
+        "name": "light bulb",
+        "material": "glass",
+        "synonyms": ["lightbulb", "led bulb", "cfl bulb", "fluorescent bulb"],
+    },
+    "food_waste": {
+        "name": "food waste",
+        "material": "organic",
+        "synonyms": ["food scraps", "banana peel", "apple core", "fruit peel", "vegetable scraps", "leftovers"],
+    },
+    "coffee_grounds": {
+        "name": "coffee grounds",
+        "material": "organic",
+        "synonyms": ["used coffee grounds", "coffee filter"],
+    },
+    "textile": {
+        "name": "textile",
+        "material": "fabric",
+        "synonyms": ["clothing", "clothes", "t shirt", "fabric", "old clothes", "shoes"],
+    },
+    "chip_bag": {
+        "name": "chip bag",
+        "material": "plastic",
+        "synonyms": ["crisp packet", "snack bag", "chips bag", "candy wrapper", "food wrapper"],
+    },
+}
+
+# Words that describe the item's state rather than what it is
+STOPWORDS = {
+    "a", "an", "the", "of", "some", "empty", "used", "crushed", "old", "dirty", "clean",
+    "small", "large", "big", "piece", "pieces", "partially", "half", "full",
+}
+
+# Minimum trigram similarity for a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+
+def singularize(word):
+    if len(word) > 3 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith(("ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    """Lowercase, drop parentheticals, punctuation and state words, singularize"""
+    text = re.sub(r"\(.*?\)|\[.*?\]", " ", text.lower())
+    text = re.sub(r"[^a-z0-9]+", " ", text)
+    words = [singularize(word) for word in text.split() if word not in STOPWORDS]
+    return " ".join(words)
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ItemIndex:
+    """Exact and trigram lookup from normalized names to canonical item IDs"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.exact = {}
+        self.grams = {}
+        self.postings = defaultdict(set)
+        self.stats = {"exact": 0, "fuzzy": 0, "unmatched": 0}
+        self.lock = threading.Lock()
+
+        for item_id, entry in catalog.items():
+            for name in [entry["name"], *entry["synonyms"]]:
+                key = normalize(name)
+                self.exact.setdefault(key, item_id)
+                self.grams[key] = trigrams(key)
+                for gram in self.grams[key]:
+                    self.postings[gram].add(key)
+
+    def match(self, text):
+        """Return (item_id, match kind) for a detected item name"""
+        key = normalize(text)
+        if not key:
+            return None, "unmatched"
+        if key in self.exact:
+            return self.exact[key], "exact"
+        if " " not in key:
+            # A bare noun like "bottle" or "glass" doesn't say which item it is
+            return "custom:" + key, "unmatched"
+
+        # Score only the synonyms that share at least one trigram
+        query = trigrams(key)
+        overlap = defaultdict(int)
+        for gram in query:
+            for candidate in self.postings.get(gram, ()):
+                overlap[candidate] += 1
+
+        # The last word names the kind of item ("plastic wrap" is a wrap, not a
+        # bottle cap), so only synonyms with the same head noun can match
+        head = key.split()[-1]
+        best, best_score = None, 0.0
+        for candidate, shared in overlap.items():
+            if candidate.split()[-1] != head:
+                continue
+            score = shared / (len(query) + len(self.grams[candidate]) - shared)
+            if score > best_score:
+                best, best_score = candidate, score
+
+        if best is not None and best_score >= FUZZY_THRESHOLD:
+            return self.exact[best], "fuzzy"
+        # Unknown items still get a stable ID built from the normalized text
+        return "custom:" + key.replace(" ", "_"), "unmatched"
+
+    def canonicalize(self, text):
+        item_id, kind = self._match_cached(text)
+        with self.lock:
+            self.stats[kind] += 1
+        return item_id
+
+    @lru_cache(maxsize=4096)
+    def _match_cached(self, text):
+        return self.match(text)
+
+    def hit_rate(self):
+        with self.lock:
+            total = sum(self.stats.values())
+            hits = self.stats["exact"] + self.stats["fuzzy"]
+        return hits / total if total else 0.0
+
+
+ITEM_INDEX = ItemIndex(CATALOG)
+
+
+def canonicalize_item(text):
+    """Map a detected item name to its canonical item ID"""
+    return ITEM_INDEX.canonicalize(text)
+
+
+def canonical_name(item_id):
+    """Human-readable name for a canonical item ID"""
+    if item_id in CATALOG:
+        return CATALOG[item_id]["name"]
+    return item_id.split(":", 1)[-1].replace("_", " ")
+
+
+def prompt_item_names(items):
+    """Sorted, de-duplicated detected names for use in prompts
+
+    Prompts describe what was actually detected; canonical IDs are only used
+    as cache keys.
+    """
+    names = {}
+    for item in items:
+        name = " ".join(str(item).split())
+        if name:
+            names.setdefault(name.lower(), name)
+    return sorted(names.values(), key=str.lower)
+
+
+def canonicalization_stats():
+    """Match counters and hit rate since the process started"""
+    with ITEM_INDEX.lock:
+        stats = dict(ITEM_INDEX.stats)
+    stats["hit_rate"] = ITEM_INDEX.hit_rate()
+    return stats
@@ -0,0 +1,148 @@
+"""Chunking and merging for flowcharts of long lecture PDFs.
+
+split_sections() cuts extracted text into chunks at section headings so each
+chunk can be turned into its own sub-flowchart; merge_flowcharts() combines
+the sub-flowcharts into one node/edge graph, merging nodes with the same
+text, linking the chunks' top-level nodes in document order and keeping at
+most a given number of nodes.
+"""
+import re
+
+# Lines that start a new section: "Lecture 3", "Chapter 2: ...", "1.2 Title", "INTRODUCTION"
+HEADING = re.compile(
+    r"^(?:(?i:chapter|lecture|section|part|unit|module|week|topic)\b.{0,80}"
+    r"|\d{1,2}(?:\.\d{1,2})*\.?\s+[A-Z].{0,80}"
+    r"|[A-Z][A-Z0-9 ,:&()'/-]{3,80})$"
+)
+
+
+def split_sections(text, max_chars):
+    """Split text into chunks of at most max_chars, breaking at headings where possible"""
+    sections = []
+    current = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if current and HEADING.match(stripped) and not stripped.endswith((".", ",", ";")):
+            sections.append("\n".join(current))
+            current = []
+        if stripped:
+            current.append(stripped)
+    if current:
+        sections.append("\n".join(current))
+
+    # Pack whole sections into chunks; only oversized sections are cut, at line breaks
+    chunks = []
+    current = []
+    size = 0
+    for section in sections:
+        for piece in split_long(section, max_chars):
+            if current and size + len(piece) + 1 > max_chars:
+                chunks.append("\n".join(current))
+                current = []
+                size = 0
+            current.append(piece)
+            size += len(piece) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def split_long(section, max_chars):
+    if len(section) <= max_chars:
+        return [section]
+    pieces = []
+    current = []
+    size = 0
+    for line in section.split("\n"):
+        while len(line) > max_chars:
+            # A single line longer than a chunk (no line breaks in the source)
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and size + len(line) + 1 > max_chars:
+            pieces.append("\n".join(current))
+            current = []
+            size = 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def node_key(text):
+    """Normalized node text, so "Photosynthesis" and "photosynthesis." merge"""
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text).lower()).split())
+
+
+def check_flowchart(chart):
+    """Return chart if it has the node/edge lists merge_flowcharts reads, else raise ValueError"""
+    if not isinstance(chart, dict) or not isinstance(chart.get("nodes"), list) or not isinstance(chart.get("edges", []), list):
+        raise ValueError("Flowchart response is not an object with node and edge lists")
+    return chart
+
+
+def node_level(value):
+    """A node's level as a positive int; unreadable levels like "two" count as 1"""
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError, OverflowError):
+        return 1
+
+
+def merge_flowcharts(charts, max_nodes):
+    """Merge sub-flowcharts (in document order) into one graph of at most max_nodes nodes"""
+    merged = {}  # node key -> {"text", "level", "order"}
+    edges = []
+    roots = []
+    for chart in charts:
+        ids = {}
+        chart_roots = []
+        for node in chart.get("nodes", []):
+            if not isinstance(node, dict):
+                continue
+            key = node_key(node.get("text", ""))
+            if not key:
+                continue
+            level = node_level(node.get("level"))
+            if key in merged:
+                merged[key]["level"] = min(merged[key]["level"], level)
+            else:
+                merged[key] = {"text": str(node["text"]).strip(), "level": level, "order": len(merged)}
+            ids[str(node.get("id"))] = key
+            if level == 1 and key not in chart_roots:
+                chart_roots.append(key)
+        for edge in chart.get("edges", []):
+            if not isinstance(edge, dict):
+                continue
+            source = ids.get(str(edge.get("from")))
+            target = ids.get(str(edge.get("to")))
+            if source and target:
+                edges.append((source, target))
+        # Fall back to the chunk's first node when it marks no top-level node
+        if not chart_roots and ids:
+            chart_roots.append(next(iter(ids.values())))
+        roots.extend(key for key in chart_roots if key not in roots)
+
+    # Stitch the chunks together by following the top-level topics in order
+    edges.extend(zip(roots, roots[1:]))
+
+    # Keep the highest-level nodes, earliest in the document first
+    kept = sorted(merged, key=lambda key: (merged[key]["level"], merged[key]["order"]))[:max_nodes]
+    kept.sort(key=lambda key: merged[key]["order"])
+    new_ids = {key: str(index) for index, key in enumerate(kept, start=1)}
+
+    seen = set()
+    merged_edges = []
+    for source, target in edges:
+        if source == target or source not in new_ids or target not in new_ids or (source, target) in seen:
+            continue
+        seen.add((source, target))
+        merged_edges.append({"from": new_ids[source], "to": new_ids[target]})
+
+    return {
+        "nodes": [
+            {"id": new_ids[key], "text": merged[key]["text"], "level": merged[key]["level"]}
+            for key in kept
+        ],
+        "edges": merged_edges,
+    }
@@ -0,0 +1,117 @@
+"""Per-page PDF text extraction.
+
+PyPDF2 reads every page first; only pages it gets little text from (scans,
+unusual font encodings) are read again with pdfplumber. Documents with many
+pages are split into page ranges that are extracted on a process pool, since
+both parsers are pure Python and hold the GIL.
+"""
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from multiprocessing import get_context
+
+# Pages with fewer characters than this from PyPDF2 are retried with pdfplumber
+MIN_PAGE_CHARS = int(os.getenv("PDF_MIN_PAGE_CHARS", "25"))
+# Documents with at least this many pages are extracted on the process pool
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def extract_pages(pdf_file, start=0, stop=None, reader=None):
+    """Extract pages [start, stop) of a PDF; returns (texts, timings)
+
+    pdf_file can be a path, bytes or a seekable binary file, with an already
+    open PdfReader for it passed as reader. Each timing is a dict with the page
+    number, the extractor whose text was kept, the character count and the
+    milliseconds spent on the page.
+    """
+    from PyPDF2 import PdfReader
+
+    if isinstance(pdf_file, (bytes, bytearray, memoryview)):
+        pdf_file = io.BytesIO(pdf_file)
+    reader = reader or PdfReader(pdf_file)
+    stop = len(reader.pages) if stop is None else stop
+
+    texts = []
+    timings = []
+    for index in range(start, stop):
+        page_start = time.perf_counter()
+        text = (reader.pages[index].extract_text() or "").strip()
+        texts.append(text)
+        timings.append({
+            "page": index + 1,
+            "extractor": "pypdf2",
+            "chars": len(text),
+            "ms": (time.perf_counter() - page_start) * 1000,
+        })
+
+    # Re-read only the weak pages, after PyPDF2 is done with the file
+    weak = [offset for offset, text in enumerate(texts) if len(text) < MIN_PAGE_CHARS]
+    if weak:
+        import pdfplumber
+
+        if hasattr(pdf_file, "seek"):
+            pdf_file.seek(0)
+        with pdfplumber.open(pdf_file) as pdf:
+            for offset in weak:
+                page_start = time.perf_counter()
+                text = (pdf.pages[start + offset].extract_text() or "").strip()
+                timing = timings[offset]
+                timing["ms"] += (time.perf_counter() - page_start) * 1000
+                if len(text) > len(texts[offset]):
+                    texts[offset] = text
+                    timing["extractor"] = "pdfplumber"
+                    timing["chars"] = len(text)
+    return texts, timings
+
+
+@lru_cache(maxsize=None)
+def get_pdf_executor():
+    """Process pool for large documents, started on first use"""
+    # Spawned workers don't inherit the server's threads and locks
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=get_context("spawn"))
+
+
+def extract_text(pdf_file):
+    """Extract a PDF's text page by page; returns (text, timings)
+
+    Small documents are read in this process straight from pdf_file. Larger
+    ones are read into bytes once and their page ranges handed to the process
+    pool, falling back to this process if a pool can't be started here.
+    """
+    from PyPDF2 import PdfReader
+
+    if isinstance(pdf_file, (bytes, bytearray, memoryview)):
+        pdf_file = io.BytesIO(pdf_file)
+    reader = PdfReader(pdf_file)
+    pages = len(reader.pages)
+
+    if pages >= PARALLEL_MIN_PAGES and PDF_WORKERS > 1:
+        if isinstance(pdf_file, (str, os.PathLike)):
+            with open(pdf_file, "rb") as f:
+                data = f.read()
+        else:
+            pdf_file.seek(0)
+            data = pdf_file.read()
+        # One range per worker, since every task gets its own copy of the document
+        size = -(-pages // PDF_WORKERS)
+        ranges = [(start, min(start + size, pages)) for start in range(0, pages, size)]
+        try:
+            executor = get_pdf_executor()
+            results = list(executor.map(extract_pages, [data] * len(ranges), *zip(*ranges)))
+        except (OSError, NotImplementedError, BrokenProcessPool):
+            # Some serverless runtimes have no working multiprocessing
+            get_pdf_executor.cache_clear()
+            results = [extract_pages(data)]
+    else:
+        results = [extract_pages(pdf_file, reader=reader)]
+
+    texts = []
+    timings = []
+    for range_texts, range_timings in results:
+        texts.extend(range_texts)
+        timings.extend(range_timings)
+    return "\n".join(text for text in texts if text), timings
@@ -0,0 +1,125 @@
+"""HTTP endpoints for the EcoScan pipeline.
+
+Mounted on the FastAPI app in api/main.py. The endpoints are stateless -
+chat history travels with each request - so the API can scale out under
+uvicorn workers or the Mangum handler. Upstream calls use the async
+pipeline variants, so a worker keeps serving other requests while Gemini
+is answering.
+"""
+import os
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, UploadFile
+from pydantic import BaseModel, Field, constr
+
+import call_gateway
+from call_gateway import CircuitOpenError
+from canonical_items import canonicalize_item, prompt_item_names
+from ecoscan_pipeline import (
+    CHAT_CONTEXT_SHARE,
+    CHAT_TOKEN_BUDGET,
+    InvalidImageError,
+    build_chat_history,
+    detect_items_async,
+    get_chatbot_response_async,
+    get_environmental_metrics_async,
+    get_recycling_instructions_async,
+)
+
+# Largest image accepted by /api/scan
+MAX_IMAGE_BYTES = int(os.getenv("ECOSCAN_MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+# Limits for /api/scan/metrics; each unseen name is a Gemini call and a metrics cache entry
+MAX_METRICS_ITEMS = int(os.getenv("ECOSCAN_MAX_METRICS_ITEMS", "25"))
+MAX_ITEM_NAME_CHARS = 100
+
+router = APIRouter(prefix="/api")
+
+
+class MetricsRequest(BaseModel):
+    items: List[constr(strip_whitespace=True, min_length=1, max_length=MAX_ITEM_NAME_CHARS)] = Field(max_length=MAX_METRICS_ITEMS)
+
+
+class ChatMessage(BaseModel):
+    text: str
+    is_user: bool
+
+
+class ChatRequest(BaseModel):
+    message: str
+    history: List[ChatMessage] = []
+    items: List[str] = []
+    recycling_advice: Optional[str] = None
+    environmental_impact: Optional[str] = None
+
+
+def require_gemini():
+    """Fail fast with 503 when Gemini is not configured or its circuit is open"""
+    if not os.getenv("GOOGLE_API_KEY"):
+        raise HTTPException(status_code=503, detail="GOOGLE_API_KEY is not configured")
+    if call_gateway.BACKENDS["gemini"].breaker.state == "open":
+        raise HTTPException(status_code=503, detail="Gemini is temporarily unavailable")
+
+
+@router.post("/scan")
+async def scan_image(file: UploadFile, instructions: bool = True):
+    """Detect items in an uploaded photo and return recycling instructions for them"""
+    if file.content_type and not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Only image files are accepted")
+    require_gemini()
+
+    image_bytes = await file.read()
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    if len(image_bytes) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Images are limited to {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+
+    image_stats = {}
+    try:
+        detections = await detect_items_async(image_bytes, image_stats)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Gemini is temporarily unavailable")
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Item detection failed: {type(e).__name__}")
+    if not detections:
+        raise HTTPException(status_code=422, detail="No recyclable items detected")
+
+    item_names = prompt_item_names([detection["name"] for detection in detections])
+    result = {"items": detections, "item_names": item_names, "image_stats": image_stats}
+    if instructions:
+        result["instructions"] = await get_recycling_instructions_async(", ".join(item_names))
+    return result
+
+
+@router.post("/scan/metrics")
+async def scan_metrics(request: MetricsRequest):
+    """Aggregate environmental metrics for a list of detected item names"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items given")
+    require_gemini()
+
+    metrics = await get_environmental_metrics_async(request.items)
+    if metrics is None:
+        raise HTTPException(status_code=502, detail="Could not compute environmental metrics")
+    return {"item_ids": [canonicalize_item(item) for item in request.items], "metrics": metrics}
+
+
+@router.post("/chat")
+async def chat(request: ChatRequest):
+    """Answer an EcoBot question using the scan results and history sent by the client"""
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Empty message")
+    require_gemini()
+
+    # Same budget split as the Streamlit chat panel
+    history_budget = CHAT_TOKEN_BUDGET - int(CHAT_TOKEN_BUDGET * CHAT_CONTEXT_SHARE)
+    context = build_chat_history([{"text": message.text, "is_user": message.is_user} for message in request.history], history_budget)
+    reply = await get_chatbot_response_async(
+        request.message,
+        context=context,
+        items=request.items,
+        recycling_advice=request.recycling_advice,
+        environmental_impact=request.environmental_impact,
+    )
+    return {"reply": reply}
@@ -0,0 +1,191 @@
+"""Coalesce identical in-flight upstream requests.
+
+The first caller for a key runs the request; concurrent callers with the
+same key wait for it and share its result. Within one process this is a
+map of futures. When ECOSCAN_SINGLE_FLIGHT_DIR is set, leaders in different
+worker processes also coordinate through a per-key lock file and a small
+SQLite table holding results, stored as JSON, for ECOSCAN_SINGLE_FLIGHT_TTL
+seconds.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+
+SHARED_DIR = os.getenv("ECOSCAN_SINGLE_FLIGHT_DIR")
+RESULT_TTL = float(os.getenv("ECOSCAN_SINGLE_FLIGHT_TTL", "10"))
+
+
+def request_key(model_name, generation_config, contents):
+    """Hash of (model, generation config, prompt, image bytes) for a Gemini request"""
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(json.dumps(generation_config, sort_keys=True, default=str).encode("utf-8"))
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, dict) and "data" in part:
+            digest.update(hashlib.sha256(part["data"]).digest())
+        else:
+            digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SharedResults:
+    """Cross-process result table guarded by per-key lock files"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "results.sqlite")
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def lookup(self, key):
+        with self.connect() as db:
+            row = db.execute(
+                "SELECT value FROM results WHERE key = ? AND created > ?",
+                (key, time.time() - RESULT_TTL)
+            ).fetchone()
+        if not row:
+            return None
+        # JSON rather than pickle, so writing the shared file can't run code in other processes
+        try:
+            return json.loads(row[0])
+        except (TypeError, ValueError):
+            return None
+
+    def store(self, key, value):
+        now = time.time()
+        with self.connect() as db:
+            db.execute("DELETE FROM results WHERE created <= ?", (now - RESULT_TTL,))
+            db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, json.dumps(value), now))
+
+    def run(self, key, func):
+        """Run func unless another process produced the result moments ago"""
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                cached = self.lookup(key)
+                if cached is not None:
+                    return cached, True
+                try:
+                    result = func()
+                    if result is not None:
+                        self.store(key, result)
+                    return result, False
+                finally:
+                    # Whatever the outcome, late arrivals don't need this flight's lock file
+                    try:
+                        os.remove(lock_path)
+                    except OSError:
+                        pass
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SingleFlight:
+    """Share one upstream call between concurrent callers with the same key"""
+
+    def __init__(self, shared_dir=None):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.shared = SharedResults(shared_dir) if shared_dir and fcntl else None
+        self.stats = {"leaders": 0, "followers": 0, "shared_hits": 0}
+
+    def join(self, key):
+        """Return (future, leader) for key, registering a new flight if none is running"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = Future()
+                self.stats["leaders"] += 1
+                return flight, True
+            self.stats["followers"] += 1
+            return flight, False
+
+    def finish(self, key, flight, result=None, error=None, shared_hit=False):
+        with self.lock:
+            del self.flights[key]
+            if shared_hit:
+                self.stats["shared_hits"] += 1
+        if flight.done():
+            return
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(result)
+
+    def do(self, key, func):
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.result()
+
+        shared_hit = False
+        try:
+            if self.shared:
+                result, shared_hit = self.shared.run(key, func)
+            else:
+                result = func()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result, shared_hit=shared_hit)
+        return result
+
+    async def ado(self, key, func):
+        """Async do(): func is a coroutine function; followers may be threads or tasks"""
+        flight, leader = self.join(key)
+        if not leader:
+            # Shielded so a cancelled follower doesn't cancel the flight for everyone else
+            return await asyncio.shield(asyncio.wrap_future(flight))
+
+        shared_hit = False
+        try:
+            if self.shared:
+                # The lock file is held from a worker thread while the request runs on this loop
+                loop = asyncio.get_running_loop()
+                result, shared_hit = await asyncio.to_thread(
+                    self.shared.run, key, lambda: asyncio.run_coroutine_threadsafe(func(), loop).result()
+                )
+            else:
+                result = await func()
+        except BaseException as e:  # includes cancellation, which must not strand followers
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result, shared_hit=shared_hit)
+        return result
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+SINGLE_FLIGHT = SingleFlight(SHARED_DIR)
+
+
+def coalesce(key, func):
+    """Return func(), sharing the call with concurrent callers that use the same key"""
+    return SINGLE_FLIGHT.do(key, func)
+
+
+async def coalesce_async(key, func):
+    """Await func(), sharing the call with concurrent callers (sync or async) that use the same key"""
+    return await SINGLE_FLIGHT.ado(key, func)
+
+
+def single_flight_stats():
+    return SINGLE_FLIGHT.snapshot()
@@ -0,0 +1,235 @@
+"""Per-stage spans around upstream calls, exported as Prometheus text.
+
+Wrap each upstream call in `with span("stage"):`. The span records its
+latency and whether it raised, and code running inside it can add token
+counts, payload sizes and cache results through record(). Aggregates are
+kept per process; prometheus_text() renders them (plus the gateway and
+coalescing counters) for the /api/metrics route.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from call_gateway import gateway_stats
+from single_flight import single_flight_stats
+
+# Histogram bucket bounds for stage latency, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Latencies kept per stage for the percentiles in the diagnostics panel
+RECENT_SAMPLES = 200
+
+# Fields accepted by record(), mapped to (metric, label name, label value)
+FIELDS = {
+    "input_tokens": ("ecoscan_stage_tokens_total", "direction", "input"),
+    "output_tokens": ("ecoscan_stage_tokens_total", "direction", "output"),
+    "bytes_sent": ("ecoscan_stage_bytes_total", "direction", "sent"),
+    "bytes_received": ("ecoscan_stage_bytes_total", "direction", "received"),
+    "cache_hits": ("ecoscan_stage_cache_total", "result", "hit"),
+    "cache_misses": ("ecoscan_stage_cache_total", "result", "miss"),
+}
+
+METRIC_HELP = {
+    "ecoscan_stage_duration_seconds": ("histogram", "Latency of upstream calls by stage"),
+    "ecoscan_stage_errors_total": ("counter", "Stage calls that raised"),
+    "ecoscan_stage_tokens_total": ("counter", "Gemini tokens by stage and direction"),
+    "ecoscan_stage_bytes_total": ("counter", "Request and response payload bytes by stage"),
+    "ecoscan_stage_cache_total": ("counter", "Cache lookups by stage and result"),
+    "ecoscan_gateway_calls_total": ("counter", "Gateway calls by backend and outcome"),
+    "ecoscan_gateway_in_flight": ("gauge", "Requests currently running per backend"),
+    "ecoscan_gateway_throttled_seconds_total": ("counter", "Time spent waiting on the rate limiter"),
+    "ecoscan_gateway_circuit_open": ("gauge", "1 when the backend's circuit breaker is open"),
+    "ecoscan_coalesced_requests_total": ("counter", "Requests by single-flight role"),
+}
+
+_current = contextvars.ContextVar("ecoscan_span", default=None)
+
+
+class Span:
+    def __init__(self, stage):
+        self.stage = stage
+        self.fields = defaultdict(float)
+
+    def record(self, **fields):
+        for name, value in fields.items():
+            if name not in FIELDS:
+                raise ValueError(f"Unknown span field: {name}")
+            self.fields[name] += value or 0
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.fields = defaultdict(float)
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+
+class Registry:
+    """Thread-safe per-stage aggregates"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, stage, **fields):
+        """Add counts to a stage without recording a call"""
+        with self.lock:
+            stats = self.stages.setdefault(stage, StageStats())
+            for name, value in fields.items():
+                stats.fields[name] += value
+
+    def observe(self, span, seconds, error):
+        with self.lock:
+            stats = self.stages.setdefault(span.stage, StageStats())
+            stats.count += 1
+            stats.errors += int(error)
+            stats.seconds += seconds
+            index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            if index < len(stats.buckets):
+                stats.buckets[index] += 1
+            stats.recent.append(seconds)
+            for name, value in span.fields.items():
+                stats.fields[name] += value
+
+    def snapshot(self):
+        """One summary row per stage, for display"""
+        rows = []
+        with self.lock:
+            for stage, stats in sorted(self.stages.items()):
+                recent = sorted(stats.recent)
+                lookups = stats.fields["cache_hits"] + stats.fields["cache_misses"]
+                rows.append({
+                    "stage": stage,
+                    "calls": stats.count,
+                    "errors": stats.errors,
+                    "mean_ms": round(stats.seconds / stats.count * 1000, 1) if stats.count else None,
+                    "p95_ms": round(recent[int(0.95 * (len(recent) - 1))] * 1000, 1) if recent else None,
+                    "input_tokens": int(stats.fields["input_tokens"]),
+                    "output_tokens": int(stats.fields["output_tokens"]),
+                    "bytes_sent": int(stats.fields["bytes_sent"]),
+                    "bytes_received": int(stats.fields["bytes_received"]),
+                    "cache_hit_rate": round(stats.fields["cache_hits"] / lookups, 2) if lookups else None,
+                })
+        return rows
+
+    def samples(self):
+        """(metric, labels, value) for every stage series"""
+        with self.lock:
+            for stage, stats in sorted(self.stages.items()):
+                labels = {"stage": stage}
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    yield "ecoscan_stage_duration_seconds_bucket", {**labels, "le": str(bound)}, cumulative
+                yield "ecoscan_stage_duration_seconds_bucket", {**labels, "le": "+Inf"}, stats.count
+                yield "ecoscan_stage_duration_seconds_sum", labels, stats.seconds
+                yield "ecoscan_stage_duration_seconds_count", labels, stats.count
+                yield "ecoscan_stage_errors_total", labels, stats.errors
+                for name, (metric, label, value) in FIELDS.items():
+                    if name in stats.fields:
+                        yield metric, {**labels, label: value}, stats.fields[name]
+
+
+REGISTRY = Registry()
+
+
+@contextmanager
+def span(stage):
+    """Time an upstream call; exceptions are counted as errors and re-raised"""
+    current = Span(stage)
+    token = _current.set(current)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield current
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _current.reset(token)
+        REGISTRY.observe(current, time.perf_counter() - start, error)
+
+
+def observe(stage, seconds, error=False):
+    """Record a call timed elsewhere, such as a PDF page extracted in a worker process"""
+    REGISTRY.observe(Span(stage), seconds, error)
+
+
+def record(**fields):
+    """Add token, byte or cache counts to the innermost open span, if any"""
+    current = _current.get()
+    if current is not None:
+        current.record(**fields)
+
+
+def record_cache(stage, hit):
+    """Count a cache lookup for a stage; hits are not timed as calls"""
+    REGISTRY.add(stage, cache_hits=int(hit), cache_misses=int(not hit))
+
+
+def payload_bytes(contents):
+    """Size of a Gemini request: prompt text plus inline image data"""
+    total = 0
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, dict) and "data" in part:
+            total += len(part["data"])
+        else:
+            total += len(str(part).encode("utf-8"))
+    return total
+
+
+def record_gemini_response(contents, response, text):
+    """Record payload sizes and the token counts Gemini reports for a response"""
+    metadata = getattr(response, "usage_metadata", None)
+    record(
+        bytes_sent=payload_bytes(contents),
+        bytes_received=len(text.encode("utf-8")) if text else 0,
+        input_tokens=getattr(metadata, "prompt_token_count", 0) or 0,
+        output_tokens=getattr(metadata, "candidates_token_count", 0) or 0,
+    )
+
+
+def stage_stats():
+    return REGISTRY.snapshot()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def prometheus_text():
+    """All stage, gateway and coalescing metrics in the Prometheus text format"""
+    samples = list(REGISTRY.samples())
+    for backend, stats in gateway_stats().items():
+        labels = {"backend": backend}
+        for outcome in ("successes", "failures", "retries", "rejected"):
+            samples.append(("ecoscan_gateway_calls_total", {**labels, "outcome": outcome}, stats[outcome]))
+        samples.append(("ecoscan_gateway_in_flight", labels, stats["in_flight"]))
+        samples.append(("ecoscan_gateway_throttled_seconds_total", labels, stats["throttled_seconds"]))
+        samples.append(("ecoscan_gateway_circuit_open", labels, int(stats["circuit"] == "open")))
+    for role, count in single_flight_stats().items():
+        samples.append(("ecoscan_coalesced_requests_total", {"role": role}, count))
+
+    # Samples of one metric family have to be contiguous
+    families = {}
+    for name, labels, value in samples:
+        family = name
+        if name.startswith("ecoscan_stage_duration_seconds_"):
+            family = "ecoscan_stage_duration_seconds"
+        families.setdefault(family, []).append(f"{name}{format_labels(labels)} {value}")
+
+    lines = []
+    for family, family_lines in families.items():
+        kind, help_text = METRIC_HELP[family]
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        lines.extend(family_lines)
+    return "\n".join(lines) + "\n"
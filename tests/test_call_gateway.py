@@ -0,0 +1,189 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import call_gateway
+from call_gateway import Backend, CircuitBreaker, CircuitOpenError, is_retryable
+
+
+class UpstreamError(Exception):
+    def __init__(self, code):
+        super().__init__(f"status {code}")
+        self.code = code
+
+
+def make_backend(**kwargs):
+    options = {"rate": 1000, "burst": 1000, "max_concurrency": 4, "base_delay": 0, "max_delay": 0}
+    options.update(kwargs)
+    return Backend("test", **options)
+
+
+def fail(error):
+    def func():
+        raise error
+    return func
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_allows_one_trial(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(call_gateway.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] += 30
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_trial_success_closes_and_failure_reopens(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(call_gateway.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_open_circuit_rejects_calls():
+    backend = make_backend(failure_threshold=1, reset_seconds=60, max_retries=0)
+    with pytest.raises(TimeoutError):
+        backend.call(fail(TimeoutError()))
+    with pytest.raises(CircuitOpenError):
+        backend.call(lambda: "unreachable")
+    assert backend.snapshot()["rejected"] == 1
+
+
+def test_interrupted_trial_frees_the_breaker():
+    backend = make_backend(failure_threshold=1, reset_seconds=0, max_retries=0)
+    with pytest.raises(TimeoutError):
+        backend.call(fail(TimeoutError()))
+    assert backend.breaker.state == "half-open"
+
+    with pytest.raises(KeyboardInterrupt):
+        backend.call(fail(KeyboardInterrupt()))
+    assert not backend.breaker.trial_running
+    assert backend.call(lambda: "ok") == "ok"
+    assert backend.breaker.state == "closed"
+
+
+def test_cancelled_async_trial_frees_the_breaker():
+    backend = make_backend(failure_threshold=1, reset_seconds=0, max_retries=0)
+
+    async def timeout():
+        raise TimeoutError()
+
+    async def ok():
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(TimeoutError):
+            await backend.acall(timeout)
+        trial = asyncio.create_task(backend.acall(asyncio.sleep, 10))
+        await asyncio.sleep(0.01)
+        assert backend.breaker.trial_running
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        return await backend.acall(ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert backend.breaker.state == "closed"
+
+
+@pytest.mark.parametrize("error", [
+    TimeoutError(),
+    ConnectionError(),
+    UpstreamError(429),
+    UpstreamError(503),
+    SimpleNamespace(status_code=502),
+    SimpleNamespace(response=SimpleNamespace(status_code=500)),
+    type("DeadlineExceeded", (Exception,), {})(),
+])
+def test_retryable_errors(error):
+    assert is_retryable(error)
+
+
+@pytest.mark.parametrize("error", [
+    UpstreamError(400),
+    UpstreamError(404),
+    ValueError("bad response"),
+    SimpleNamespace(code="not a status"),
+])
+def test_non_retryable_errors(error):
+    assert not is_retryable(error)
+
+
+def test_retryable_errors_are_retried_then_raised():
+    backend = make_backend(max_retries=2, failure_threshold=5)
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        raise UpstreamError(503)
+
+    with pytest.raises(UpstreamError):
+        backend.call(flaky)
+    assert len(attempts) == 3
+    stats = backend.snapshot()
+    assert stats["retries"] == 2
+    assert stats["failures"] == 1
+    assert backend.breaker.failures == 1
+
+
+def test_retry_succeeds_after_transient_error():
+    backend = make_backend(max_retries=2)
+    results = iter([UpstreamError(429), "ok"])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert backend.call(flaky) == "ok"
+    assert backend.snapshot()["retries"] == 1
+
+
+def test_client_errors_are_not_retried_or_held_against_the_backend():
+    backend = make_backend(max_retries=3, failure_threshold=1)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise UpstreamError(400)
+
+    with pytest.raises(UpstreamError):
+        backend.call(bad_request)
+    assert len(calls) == 1
+    assert backend.breaker.state == "closed"
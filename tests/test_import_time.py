@@ -0,0 +1,11 @@
+import pytest
+
+from benchmarks.import_time import TARGETS, import_env, report
+
+
+# The Streamlit page target needs a bare-mode Streamlit run; the API and the
+# pipeline are what serverless cold starts pay for
+@pytest.mark.parametrize("target", ["api", "pipeline"])
+def test_heavy_modules_are_not_imported_at_startup(target):
+    result = report(TARGETS[target], import_env(), top=0)
+    assert result["deferred_imported"] == []
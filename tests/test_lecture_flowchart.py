@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from api import main
+from lecture_flowchart import check_flowchart, merge_flowcharts, node_level, split_sections
+
+
+@pytest.mark.parametrize("value, level", [
+    (1, 1),
+    (3, 3),
+    ("2", 2),
+    (2.7, 2),
+    ("two", 1),
+    (None, 1),
+    ([], 1),
+    (0, 1),
+    (-4, 1),
+    (float("inf"), 1),
+])
+def test_node_level_coercion(value, level):
+    assert node_level(value) == level
+
+
+@pytest.mark.parametrize("chart", [
+    [{"id": "1", "text": "Topic"}],
+    "nodes",
+    None,
+    {"edges": []},
+    {"nodes": "Topic"},
+    {"nodes": [], "edges": {"from": "1"}},
+])
+def test_check_flowchart_rejects_malformed_replies(chart):
+    with pytest.raises(ValueError):
+        check_flowchart(chart)
+
+
+def test_check_flowchart_accepts_missing_edges():
+    chart = {"nodes": [{"id": "1", "text": "Topic", "level": 1}]}
+    assert check_flowchart(chart) is chart
+
+
+def test_split_sections_breaks_at_headings():
+    text = "Chapter 1: Cells\n" + "Cells are small.\n" * 3 + "Chapter 2: Energy\n" + "Energy flows.\n" * 3
+    chunks = split_sections(text, 80)
+    assert len(chunks) == 2
+    assert chunks[0].startswith("Chapter 1: Cells")
+    assert chunks[1].startswith("Chapter 2: Energy")
+    assert all(len(chunk) <= 80 for chunk in chunks)
+
+
+def test_split_sections_cuts_oversized_lines():
+    chunks = split_sections("x" * 250, 100)
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+
+
+def test_merge_links_sections_and_merges_repeated_nodes():
+    first = {
+        "nodes": [
+            {"id": "1", "text": "Cells", "level": 1},
+            {"id": "2", "text": "Photosynthesis", "level": 2},
+        ],
+        "edges": [{"from": "1", "to": "2"}],
+    }
+    second = {
+        "nodes": [
+            {"id": "1", "text": "Energy", "level": "1"},
+            {"id": "2", "text": "photosynthesis.", "level": "two"},
+            "not a node",
+        ],
+        "edges": [{"from": "1", "to": "2"}, ["1", "2"]],
+    }
+    merged = merge_flowcharts([first, second], max_nodes=10)
+
+    texts = {node["id"]: node["text"] for node in merged["nodes"]}
+    assert list(texts.values()) == ["Cells", "Photosynthesis", "Energy"]
+    edges = {(texts[edge["from"]], texts[edge["to"]]) for edge in merged["edges"]}
+    assert edges == {("Cells", "Photosynthesis"), ("Energy", "Photosynthesis"), ("Cells", "Energy")}
+    # "two" reads as level 1, the lower of the two levels the node appears with
+    assert {node["text"]: node["level"] for node in merged["nodes"]}["Photosynthesis"] == 1
+
+
+def test_merge_keeps_top_levels_within_the_node_budget():
+    chart = {
+        "nodes": [{"id": str(index), "text": f"Node {index}", "level": 1 if index < 2 else 3} for index in range(5)],
+        "edges": [],
+    }
+    merged = merge_flowcharts([chart], max_nodes=3)
+    assert [node["text"] for node in merged["nodes"]] == ["Node 0", "Node 1", "Node 2"]
+    assert [node["id"] for node in merged["nodes"]] == ["1", "2", "3"]
+
+
+def test_invalid_chunk_is_left_out_of_the_merged_flowchart(monkeypatch):
+    replies = iter([
+        [{"id": "1", "text": "Not an object"}],
+        {"nodes": [{"id": "1", "text": "Energy", "level": "two"}], "edges": []},
+    ])
+
+    async def request_flowchart(prompt):
+        return next(replies)
+
+    monkeypatch.setattr(main, "request_flowchart", request_flowchart)
+    monkeypatch.setattr(main, "FLOWCHART_CHUNK_CHARS", 40)
+    monkeypatch.setattr(main, "FLOWCHART_CONCURRENCY", 1)
+    text = "Chapter 1: Cells\nCells are small.\nChapter 2: Energy\nEnergy flows."
+    assert asyncio.run(main.generate_flowchart(text)) == {
+        "nodes": [{"id": "1", "text": "Energy", "level": 1}],
+        "edges": [],
+    }
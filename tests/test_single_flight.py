@@ -0,0 +1,173 @@
+import asyncio
+import threading
+
+import pytest
+
+from single_flight import SharedResults, SingleFlight, fcntl
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def fail():
+    raise UpstreamError("boom")
+
+
+def start_follower(flight, key, outcome):
+    def follow():
+        try:
+            outcome["result"] = flight.do(key, lambda: "follower ran")
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=follow)
+    thread.start()
+    return thread
+
+
+def wait_for_followers(flight, count):
+    for _ in range(500):
+        if flight.snapshot()["followers"] >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("follower never joined")
+
+
+def test_follower_shares_leader_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    outcome = {}
+
+    def leader():
+        release.wait(5)
+        return "shared"
+
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", flight.do("key", leader)))
+    thread.start()
+    follower = start_follower(flight, "key", outcome)
+    wait_for_followers(flight, 1)
+    release.set()
+    thread.join(5)
+    follower.join(5)
+
+    assert result["value"] == "shared"
+    assert outcome == {"result": "shared"}
+    assert flight.snapshot() == {"leaders": 1, "followers": 1, "shared_hits": 0}
+
+
+def test_leader_error_reaches_followers():
+    flight = SingleFlight()
+    release = threading.Event()
+    outcome = {}
+    leader_outcome = {}
+
+    def leader():
+        release.wait(5)
+        raise UpstreamError("boom")
+
+    def lead():
+        try:
+            flight.do("key", leader)
+        except UpstreamError as e:
+            leader_outcome["error"] = e
+
+    thread = threading.Thread(target=lead)
+    thread.start()
+    follower = start_follower(flight, "key", outcome)
+    wait_for_followers(flight, 1)
+    release.set()
+    thread.join(5)
+    follower.join(5)
+
+    assert outcome["error"] is leader_outcome["error"]
+    # A failed flight is not reused by the next caller
+    assert flight.do("key", lambda: "retried") == "retried"
+
+
+def test_async_leader_error_reaches_followers():
+    flight = SingleFlight()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def leader():
+            await release.wait()
+            raise UpstreamError("boom")
+
+        async def follower():
+            return "follower ran"
+
+        leading = asyncio.create_task(flight.ado("key", leader))
+        await asyncio.sleep(0)
+        following = asyncio.create_task(flight.ado("key", follower))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(leading, following, return_exceptions=True)
+
+    leader_result, follower_result = asyncio.run(scenario())
+    assert isinstance(leader_result, UpstreamError)
+    assert follower_result is leader_result
+
+
+def test_cancelled_async_leader_does_not_strand_followers():
+    flight = SingleFlight()
+
+    async def scenario():
+        async def slow():
+            await asyncio.sleep(10)
+
+        leading = asyncio.create_task(flight.ado("key", slow))
+        await asyncio.sleep(0)
+        following = asyncio.create_task(flight.ado("key", slow))
+        await asyncio.sleep(0)
+        leading.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(following, 5)
+
+    asyncio.run(scenario())
+    assert not flight.flights
+
+
+def test_cancelled_async_follower_does_not_cancel_the_flight():
+    flight = SingleFlight()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def leader():
+            await release.wait()
+            return "shared"
+
+        leading = asyncio.create_task(flight.ado("key", leader))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flight.ado("key", leader)) for _ in range(2)]
+        await asyncio.sleep(0)
+        followers[0].cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(leading, *followers, return_exceptions=True)
+
+    leader_result, cancelled, other = asyncio.run(scenario())
+    assert leader_result == "shared"
+    assert isinstance(cancelled, asyncio.CancelledError)
+    assert other == "shared"
+
+
+@pytest.mark.skipif(fcntl is None, reason="cross-process coalescing needs fcntl")
+def test_shared_results_are_stored_as_json(tmp_path):
+    shared = SharedResults(str(tmp_path))
+    assert shared.run("key", lambda: "text") == ("text", False)
+    assert shared.run("key", lambda: "other") == ("text", True)
+    with shared.connect() as db:
+        assert db.execute("SELECT value FROM results").fetchone()[0] == '"text"'
+
+
+@pytest.mark.skipif(fcntl is None, reason="cross-process coalescing needs fcntl")
+def test_shared_lock_file_is_removed_whatever_the_outcome(tmp_path):
+    shared = SharedResults(str(tmp_path))
+    assert shared.run("empty", lambda: None) == (None, False)
+    with pytest.raises(UpstreamError):
+        shared.run("failed", fail)
+    assert not list(tmp_path.glob("*.lock"))
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+import call_gateway
+import ecoscan_pipeline
+from ecoscan_pipeline import SentenceStream, stream_response
+
+
+class FlakyStreamModel:
+    """Streams its chunks, failing partway through the first attempt"""
+
+    model_name = "test-model"
+
+    def __init__(self, chunks, failures=1):
+        self.chunks = chunks
+        self.failures = failures
+        self.in_flight = []
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        fail = self.failures > 0
+        self.failures -= 1
+
+        def response():
+            for index, text in enumerate(self.chunks):
+                self.in_flight.append(call_gateway.BACKENDS["gemini"].snapshot()["in_flight"])
+                if fail and index == 1:
+                    raise TimeoutError("stream dropped")
+                yield SimpleNamespace(text=text)
+        return response()
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    backend = call_gateway.Backend("gemini", rate=1000, burst=1000, max_concurrency=4, base_delay=0, max_delay=0)
+    monkeypatch.setitem(call_gateway.BACKENDS, "gemini", backend)
+    monkeypatch.setattr(ecoscan_pipeline, "record_gemini_response", lambda *args: None)
+    return backend
+
+
+def test_stream_holds_a_slot_until_the_last_chunk(gemini):
+    model = FlakyStreamModel(["Rinse it. ", "Recycle it."], failures=0)
+    assert stream_response(model, "prompt") == "Rinse it. Recycle it."
+    assert model.in_flight == [1, 1]
+    assert gemini.snapshot()["in_flight"] == 0
+
+
+def test_mid_stream_error_is_retried_from_the_start(gemini):
+    model = FlakyStreamModel(["Rinse it. ", "Recycle it."])
+    partial = []
+    assert stream_response(model, "retried prompt", partial) == "Rinse it. Recycle it."
+    assert partial == ["Rinse it. ", "Recycle it."]
+    stats = gemini.snapshot()
+    assert stats["retries"] == 1
+    assert stats["successes"] == 1
+
+
+def test_mid_stream_errors_count_against_the_breaker(gemini):
+    gemini.max_retries = 0
+    model = FlakyStreamModel(["Rinse it. ", "Recycle it."])
+    with pytest.raises(TimeoutError):
+        stream_response(model, "failing prompt")
+    assert gemini.breaker.failures == 1
+    assert gemini.snapshot()["successes"] == 0
+
+
+def test_sentence_stream_starts_over_on_retry():
+    spoken = []
+    stream = SentenceStream(spoken.append)
+    stream.append("Hello there. Rin")
+    stream.clear()
+    stream.append("Hi. Rinse it. ")
+    assert spoken == ["Hello there.", "Hi.", "Rinse it."]